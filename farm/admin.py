@@ -2,8 +2,10 @@ import logging
 from django.forms import models, ValidationError
 from django.contrib import admin
 from django.contrib.contenttypes import generic
+from django.utils.translation import ugettext_lazy as _
 
-from farm.models import Farm, Genus, Breed, Animal, Product, ProductType, Note, SecondaryBreed, AnimalAttribute, AnimalAttributeOption, ProductAttribute, ProductAttributeOption, Building, BuildingSpace, Field, FieldType, BuildingAttribute, FieldAttribute, BuildingAttributeOption, FieldAttributeOption, Milking
+from farm.models import Farm, Genus, Breed, Animal, Product, ProductType, Note, SecondaryBreed, AnimalAttribute, AnimalAttributeOption, ProductAttribute, ProductAttributeOption, Building, BuildingSpace, Field, FieldType, BuildingAttribute, FieldAttribute, BuildingAttributeOption, FieldAttributeOption, Milking, Litter
+from farm.managers import EstimatedCountQuerySet
 from notes.admin import NoteInline
 from attributes.admin import clean_attribute_value
 
@@ -23,19 +25,54 @@ class ProductAttributeInline(admin.TabularInline):
 class SecondaryBreedInline(generic.GenericTabularInline):
     model = SecondaryBreed
 
-class AnimalAdmin(admin.ModelAdmin):
-    list_filter = ('owner_farm', 'breeder_farm', 'alt_owner', 'alt_breeder', )
-    list_display = ('sex', 'name', 'dam', 'birthday', 'primary_breed',)
+class PerformanceAdmin(admin.ModelAdmin):
+    """
+    Changelist for large tables: fetches the relations in related along with
+    the rows and estimates the count of the whole table.
+    """
+    related = ()
+
+    def queryset(self, request):
+        qs = super(PerformanceAdmin, self).queryset(request)
+        if self.related:
+            qs = qs.select_related(*self.related)
+        return qs._clone(klass=EstimatedCountQuerySet)
+
+class AnimalAdmin(PerformanceAdmin):
+    list_filter = ('on_farm', 'is_mixed', 'sex', 'primary_breed', 'owner_farm', 'breeder_farm', )
+    list_display = ('sex', 'name', 'dam_name', 'birthday', 'breed_label', 'on_farm',)
+    raw_id_fields = ('dam', 'sire', 'primary_breed',)
+    related = ('dam',)
     inlines = [ AnimalAttributeInline, SecondaryBreedInline, NoteInline, ]
 
-class MilkingAdmin(admin.ModelAdmin):
+    def dam_name(self, obj):
+        return obj.dam.name or obj.dam.slug if obj.dam_id else u''
+    dam_name.short_description = _('Dam')
+    dam_name.admin_order_field = 'dam__name'
+
+class MilkingAdmin(PerformanceAdmin):
+    list_filter = ('units', )
+    list_display = ('milking_time', 'animal_name', 'quantity', 'units',)
+    raw_id_fields = ('animal',)
+    related = ('animal',)
     inlines = [ NoteInline, ]
 
+    def animal_name(self, obj):
+        return obj.animal.name or obj.animal.slug
+    animal_name.short_description = _('Animal')
+    animal_name.admin_order_field = 'animal__name'
+
+class LitterAdmin(admin.ModelAdmin):
+    list_display = ('dam', 'sire', 'start', 'size', 'born_alive', 'lost',)
+    raw_id_fields = ('dam', 'sire',)
+    readonly_fields = ('size', 'born_alive', 'lost',)
+
 class ProductAdmin(admin.ModelAdmin):
     inlines = [ ProductAttributeInline, NoteInline, ]
 
 admin.site.register(Milking, MilkingAdmin)
 admin.site.register(Animal, AnimalAdmin)
+admin.site.register(Litter, LitterAdmin)
 admin.site.register(Farm)
 admin.site.register(Genus)
 admin.site.register(Breed)
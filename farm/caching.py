@@ -0,0 +1,59 @@
+"""
+Namespaced caching for the farm.
+
+Every namespace has a generation, the time it was last invalidated, stored in
+the cache. Keys are built with the current generation, so bumping it makes all
+the entries of the namespace unreachable at once; the handlers in
+farm.signals bump namespaces when the data behind them changes.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+TIMEOUT = getattr(settings, 'FARM_CACHE_TIMEOUT', 60 * 15)
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+def _generation_key(namespace):
+    return 'farm:generation:%s' % namespace
+
+def generation(namespace):
+    """Returns the time the namespace was last invalidated."""
+    value = cache.get(_generation_key(namespace))
+    if value is None:
+        value = time.time()
+        if not cache.add(_generation_key(namespace), value, GENERATION_TIMEOUT):
+            value = cache.get(_generation_key(namespace), value)
+    return value
+
+def bump(*namespaces):
+    """Invalidates everything cached in the given namespaces."""
+    now = time.time()
+    cache.set_many(dict((_generation_key(namespace), now) for namespace in namespaces), GENERATION_TIMEOUT)
+
+def make_key(namespace, *parts):
+    return 'farm:%s:%r:%s' % (namespace, generation(namespace), ':'.join(unicode(part) for part in parts))
+
+def cached(namespace, parts, compute, timeout=TIMEOUT):
+    """
+    Returns the value cached under namespace and parts, calling compute()
+    and caching its result on a miss. compute() should return a
+    materialized value, such as a list rather than a lazy queryset.
+    """
+    key = make_key(namespace, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+def object_namespace(model, pk):
+    """Namespace of the data cached for one object, see farm.signals."""
+    return '%s-%s' % (model._meta.object_name.lower(), pk)
+
+def version(*namespaces):
+    """
+    Time the most recently invalidated of the namespaces changed, taking the
+    'detail' namespace, bumped by farm and breed changes, into account.
+    """
+    return max(generation(namespace) for namespace in ('detail',) + namespaces)
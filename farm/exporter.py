@@ -0,0 +1,116 @@
+"""
+Streaming herd export to CSV or JSON-lines files.
+
+Animal, milking and product rows are read in pk order, batch_size rows per
+query, as values() projections with the related slugs and uuids joined in,
+so an export of any size holds one batch in memory and yields its first
+lines after the first query. Animal and milking rows use the columns of
+farm.importer, so an export can be imported elsewhere.
+"""
+import csv
+import json
+from datetime import date, datetime, time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+
+from farm.models import Animal, AnimalRegistration, Milking, Product, SecondaryBreed
+
+ANIMAL_FIELDS = (
+    ('uuid', 'uuid'), ('name', 'name'), ('sex', 'sex'), ('breed', 'primary_breed__slug'),
+    ('genus', 'primary_breed__genus__slug'), ('birthday', 'birthday'), ('birthtime', 'birthtime'),
+    ('deathday', 'deathday'), ('dam', 'dam__uuid'), ('sire', 'sire__uuid'), ('breeder_farm', 'breeder_farm__slug'),
+    ('alt_breeder', 'alt_breeder'), ('owner_farm', 'owner_farm__slug'), ('alt_owner', 'alt_owner'),
+    ('description', 'description'),
+)
+MILKING_FIELDS = (
+    ('animal', 'animal__uuid'), ('milking_time', 'milking_time'), ('quantity', 'quantity'), ('units', 'units'),
+)
+PRODUCT_FIELDS = (
+    ('title', 'title'), ('slug', 'slug'), ('type', 'type__slug'), ('price', 'price'), ('unit', 'unit'),
+    ('verbose_price', 'verbose_price'), ('description', 'description'),
+)
+
+def _format(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+def _batches(queryset, fields, batch_size):
+    """Yields lists of values() dicts of queryset, keyset paged by pk."""
+    last = None
+    while True:
+        qs = queryset.order_by('pk')
+        if last is not None:
+            qs = qs.filter(pk__gt=last)
+        rows = list(qs.values('pk', *fields)[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]['pk']
+
+def _records(queryset, fields, batch_size, extend=None):
+    """Yields one dict of column to formatted value per row."""
+    for rows in _batches(queryset, [field for column, field in fields], batch_size):
+        extra = extend(rows) if extend else {}
+        for row in rows:
+            record = dict((column, _format(row[field])) for column, field in fields)
+            record.update(extra.get(row['pk'], {}))
+            yield record
+
+def _animal_extras(rows):
+    """Registrations and secondary breeds of a batch of animals, as lists."""
+    ids = [row['pk'] for row in rows]
+    extras = dict((pk, {'registrations': [], 'secondary_breeds': []}) for pk in ids)
+    for animal, body, reg_id, reg_date in AnimalRegistration.objects.filter(animal__in=ids).order_by('pk').values_list(
+            'animal', 'body__slug', 'reg_id', 'date'):
+        extras[animal]['registrations'].append([body, reg_id or '', _format(reg_date) or ''])
+    for animal, breed, percentage in SecondaryBreed.objects.filter(content_type=ContentType.objects.get_for_model(Animal),
+            object_id__in=ids).order_by('pk').values_list('object_id', 'breed__slug', 'percentage'):
+        extras[animal]['secondary_breeds'].append([breed, percentage])
+    return extras
+
+EXPORTS = {
+    'animals': (Animal, ANIMAL_FIELDS, ('registrations', 'secondary_breeds'), _animal_extras),
+    'milkings': (Milking, MILKING_FIELDS, (), None),
+    'products': (Product, PRODUCT_FIELDS, (), None),
+}
+
+def columns(kind):
+    model, fields, extra_columns, extend = EXPORTS[kind]
+    return [column for column, field in fields] + list(extra_columns)
+
+def records(kind, queryset=None, batch_size=1000):
+    """Yields the export records of kind, of queryset or of every row."""
+    model, fields, extra_columns, extend = EXPORTS[kind]
+    if queryset is None:
+        queryset = model._default_manager.all()
+    return _records(queryset, fields, batch_size, extend)
+
+class _Line(object):
+    """File-like target letting csv.writer return each line it writes."""
+    def write(self, value):
+        return value
+
+def _csv_value(value):
+    if isinstance(value, list):
+        value = ';'.join(':'.join(unicode(part) for part in item) for item in value)
+    if value is None:
+        return ''
+    return unicode(value).encode('utf-8')
+
+def export_lines(kind, format='csv', queryset=None, batch_size=1000):
+    """Yields the lines of a CSV (with a header) or JSON-lines export."""
+    if format == 'csv':
+        writer = csv.writer(_Line())
+        header = columns(kind)
+        yield writer.writerow(header)
+        for record in records(kind, queryset, batch_size):
+            yield writer.writerow([_csv_value(record.get(column)) for column in header])
+    elif format == 'jsonl':
+        for record in records(kind, queryset, batch_size):
+            yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+    else:
+        raise ValueError('Unknown format %s' % format)
@@ -0,0 +1,23 @@
+from django import forms
+from django.utils.translation import ugettext_lazy as _
+
+from farm.models import UNIT_CHOICES
+
+class ParlorSessionForm(forms.Form):
+    """
+    A whole parlor session, one "animal quantity [units]" line per animal,
+    animals given by slug or uuid prefix.
+    """
+    milking_time = forms.DateTimeField(label=_('Milking time'))
+    units = forms.ChoiceField(label=_('Units'), choices=UNIT_CHOICES, initial='ml')
+    session = forms.CharField(label=_('Session'), widget=forms.Textarea)
+
+    def rows(self):
+        """The session as rows for Milking.objects.record_session()."""
+        rows = []
+        for line in self.cleaned_data['session'].splitlines():
+            parts = line.split()
+            if parts:
+                rows.append({'animal': parts[0], 'quantity': parts[1] if len(parts) > 1 else None,
+                        'units': parts[2] if len(parts) > 2 else self.cleaned_data['units']})
+        return rows
@@ -0,0 +1,275 @@
+"""
+Bulk herd import from CSV or JSON-lines files.
+
+Animal rows have the columns uuid, name, sex, breed, birthday, birthtime,
+deathday, dam, sire, breeder_farm, alt_breeder, owner_farm, alt_owner,
+description, registrations and secondary_breeds. Breeds, farms and
+registration bodies are given by slug, dam and sire by uuid. Registrations
+are written ``body:reg_id[:date];...`` and secondary breeds
+``breed:percentage;...`` (JSON rows may use lists instead).
+
+Milking rows have the columns animal (uuid), milking_time, quantity and units.
+"""
+import csv
+import json
+from datetime import datetime
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+
+from farm import search
+from farm.caching import bump
+from farm.models import Animal, AnimalAncestry, AnimalRegistration, Breed, Farm, Litter, Milking, MilkingRollup, RegistrationBody, SecondaryBreed, UNIT_CHOICES
+from farm.pedigree import refresh_inbreeding
+from farm.utils import chunks
+
+DATE_FORMAT = '%Y-%m-%d'
+TIME_FORMATS = ('%H:%M:%S', '%H:%M')
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S')
+
+def read_rows(stream, format='csv'):
+    """Yields one dict per record of a CSV or JSON-lines stream."""
+    if format == 'csv':
+        for row in csv.DictReader(stream):
+            yield dict((key, value.decode('utf-8')) for key, value in row.iteritems() if value)
+    elif format == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError('Unknown format %s' % format)
+
+def _parse(value, formats):
+    for format in formats:
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError('Could not parse %r' % value)
+
+def _parts(value):
+    """Splits a 'a:b;c:d' column into lists, passing JSON lists through."""
+    if not value:
+        return []
+    if isinstance(value, basestring):
+        value = [item for item in value.split(';') if item.strip()]
+    return [item.split(':') if isinstance(item, basestring) else item for item in value]
+
+class HerdImporter(object):
+    """
+    Streams animal or milking rows into the database.
+
+    Lookup tables for breeds, farms and registration bodies are loaded once,
+    rows are written with bulk_create in batches of batch_size, each batch in
+    its own transaction. Rows whose uuid is already stored or was used by an
+    earlier row are skipped. With dry_run nothing is written and the rows are
+    only validated. Problems are collected in errors as (row, message).
+    """
+    def __init__(self, batch_size=1000, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.breeds = dict(Breed.objects.values_list('slug', 'pk'))
+        self.breed_titles = dict((pk, (title, genus)) for pk, title, genus in
+                Breed.objects.values_list('pk', 'title', 'genus__title'))
+        self.farms = dict(Farm.objects.values_list('slug', 'pk'))
+        self.active_farms = set(Farm.objects.filter(active=True).values_list('pk', flat=True))
+        self.bodies = dict(RegistrationBody.objects.values_list('slug', 'pk'))
+        self.animal_type = ContentType.objects.get_for_model(Animal)
+        self.animals = {}
+        self.uuids = set()
+        self.imported = []
+        self.errors = []
+        self.count = 0
+
+    def _lookup(self, table, slug, label):
+        if not slug:
+            return None
+        try:
+            return table[slug]
+        except KeyError:
+            raise ValueError('Unknown %s %s' % (label, slug))
+
+    def _resolve(self, uuids):
+        """Adds the pks of already stored animals to the uuid lookup table."""
+        missing = set(u for u in uuids if u and u not in self.animals)
+        for batch in chunks(missing, self.batch_size):
+            self.animals.update(Animal.objects.filter(uuid__in=batch).values_list('uuid', 'pk'))
+
+    def parse_animal(self, row):
+        """Returns an unsaved Animal, its parent uuids, registrations and secondary breeds."""
+        animal = Animal(uuid=row.get('uuid') or None, name=row.get('name') or None, sex=row.get('sex') or 'F',
+                alt_breeder=row.get('alt_breeder'), alt_owner=row.get('alt_owner'), description=row.get('description'))
+        animal.primary_breed_id = self._lookup(self.breeds, row.get('breed'), 'breed')
+        if animal.primary_breed_id is None:
+            raise ValueError('Missing breed')
+        animal.breeder_farm_id = self._lookup(self.farms, row.get('breeder_farm'), 'farm')
+        animal.owner_farm_id = self._lookup(self.farms, row.get('owner_farm'), 'farm')
+        for field in ('birthday', 'deathday'):
+            if row.get(field):
+                setattr(animal, field, _parse(row[field], (DATE_FORMAT,)).date())
+        animal.on_farm = animal.owner_farm_id in self.active_farms and animal.deathday is None
+        if row.get('birthtime'):
+            animal.birthtime = _parse(row['birthtime'], TIME_FORMATS).time()
+
+        registrations = []
+        for parts in _parts(row.get('registrations')):
+            date = _parse(parts[2], (DATE_FORMAT,)).date() if len(parts) > 2 and parts[2] else None
+            registrations.append((self._lookup(self.bodies, parts[0], 'registration body'), parts[1], date))
+        secondary = []
+        for breed, percentage in _parts(row.get('secondary_breeds')):
+            secondary.append((self._lookup(self.breeds, breed, 'breed'), int(percentage)))
+        title, genus = self.breed_titles[animal.primary_breed_id]
+        parts = sorted([(self.breed_titles[breed][0], percentage) for breed, percentage in secondary],
+                key=lambda part: -part[1])
+        animal.breed_label, animal.breed_composition, animal.is_mixed = Animal.objects._summary(title, genus, parts)
+        return animal, row.get('dam'), row.get('sire'), registrations, secondary
+
+    def _unique(self, parsed):
+        """Drops, as errors, the parsed rows whose uuid is stored or was seen earlier."""
+        stored = set()
+        for batch in chunks([p[1].uuid for p in parsed if p[1].uuid], self.batch_size):
+            stored.update(Animal.objects.filter(uuid__in=batch).values_list('uuid', flat=True))
+        unique = []
+        for p in parsed:
+            line, uuid = p[0], p[1].uuid
+            if uuid in stored:
+                self.errors.append((line, 'Animal %s already exists' % uuid))
+            elif uuid in self.uuids:
+                self.errors.append((line, 'Duplicate uuid %s' % uuid))
+            else:
+                if uuid:
+                    self.uuids.add(uuid)
+                unique.append(p)
+        return unique
+
+    def import_animals(self, rows):
+        """
+        Imports animal rows. Parents already stored or earlier in the file are
+        linked on insert, later ones in a second pass once every row is in.
+        """
+        pending = {}
+        for batch in chunks(enumerate(rows, 1), self.batch_size):
+            parsed = []
+            for line, row in batch:
+                try:
+                    parsed.append((line,) + self.parse_animal(row))
+                except (ValueError, TypeError), e:
+                    self.errors.append((line, unicode(e)))
+            parsed = self._unique(parsed)
+            self._resolve(uuid for p in parsed for uuid in p[2:4])
+            if self.dry_run:
+                for p in parsed:
+                    self.animals.setdefault(p[1].uuid or p[0], None)
+                    self._link(p, pending)
+            else:
+                with transaction.commit_on_success():
+                    self._write_animals(parsed, pending)
+            self.count += len(parsed)
+
+        self._resolve(uuid for field, uuid in pending)
+        with transaction.commit_on_success():
+            parents = {'dam': {}, 'sire': {}}
+            for (field, uuid), children in pending.iteritems():
+                if uuid not in self.animals:
+                    self.errors.extend((line, 'Unknown %s %s' % (field, uuid)) for line, pk in children)
+                elif not self.dry_run:
+                    parents[field].update((pk, self.animals[uuid]) for line, pk in children)
+            for field, links in parents.iteritems():
+                self._set_parents(field, links)
+            if self.imported:
+                self.finish(self.imported)
+
+    def _set_parents(self, field, links):
+        """
+        Sets the dam or sire of many animals from a dict of animal pk to
+        parent pk, with one UPDATE ... CASE per batch instead of one per parent.
+        """
+        qn = connection.ops.quote_name
+        table, pk, column = qn(Animal._meta.db_table), qn(Animal._meta.pk.column), qn(Animal._meta.get_field(field).column)
+        cursor = connection.cursor()
+        for batch in chunks(links.items(), 300):
+            cursor.execute('UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (table, column, pk,
+                    ' '.join(['WHEN %s THEN %s'] * len(batch)), pk, ', '.join(['%s'] * len(batch))),
+                    [value for link in batch for value in link] + [child for child, parent in batch])
+
+    def _link(self, parsed, pending):
+        line, animal, dam, sire = parsed[:4]
+        for field, uuid in (('dam', dam), ('sire', sire)):
+            if not uuid:
+                continue
+            if self.animals.get(uuid):
+                setattr(animal, '%s_id' % field, self.animals[uuid])
+            else:
+                pending.setdefault((field, uuid), []).append((line, animal))
+
+    def _write_animals(self, parsed, pending):
+        links = {}
+        for p in parsed:
+            self._link(p, links)
+        animals = [p[1] for p in parsed]
+        Animal.objects.assign_slugs(animals)
+        Animal.objects.bulk_create(animals)
+        created = dict(Animal.objects.filter(uuid__in=[a.uuid for a in animals]).values_list('uuid', 'pk'))
+        self.animals.update(created)
+        self.imported.extend(created.itervalues())
+
+        for key, children in links.iteritems():
+            pending.setdefault(key, []).extend((line, self.animals[a.uuid]) for line, a in children)
+        registrations, secondary = [], []
+        for line, animal, dam, sire, regs, breeds in parsed:
+            pk = self.animals[animal.uuid]
+            registrations.extend(AnimalRegistration(animal_id=pk, body_id=body, reg_id=reg_id, date=date)
+                    for body, reg_id, date in regs)
+            secondary.extend(SecondaryBreed(content_type=self.animal_type, object_id=pk, breed_id=breed,
+                    percentage=percentage) for breed, percentage in breeds)
+        AnimalRegistration.objects.bulk_create(registrations)
+        SecondaryBreed.objects.bulk_create(secondary)
+
+    def finish(self, animal_ids):
+        """
+        Brings the data Animal.save() maintains up to date for animals written
+        with bulk_create: ancestry, inbreeding, litters and search entries.
+        Breed summaries were filled in by parse_animal.
+        """
+        AnimalAncestry.objects.rebuild(animal_ids)
+        refresh_inbreeding(animal_ids)
+        dams = set()
+        for batch in chunks(animal_ids, self.batch_size):
+            dams.update(Animal.objects.filter(pk__in=batch, dam__isnull=False).values_list('dam', flat=True))
+        Litter.objects.rebuild(dams)
+        search.index(Animal, animal_ids)
+        bump('tags', 'stats', 'pedigree')
+
+    def parse_milking(self, row):
+        uuid = row.get('animal')
+        if not self.animals.get(uuid):
+            raise ValueError('Unknown animal %s' % uuid)
+        units = row.get('units') or 'ml'
+        if units not in dict(UNIT_CHOICES):
+            raise ValueError('Unknown units %s' % units)
+        milking = Milking(animal_id=self.animals[uuid], milking_time=_parse(row.get('milking_time') or '', DATETIME_FORMATS),
+                quantity=int(row.get('quantity')), units=units)
+        milking.normalize()
+        return milking
+
+    def import_milkings(self, rows):
+        """
+        Imports milking rows for animals already in the database, then
+        rebuilds the milking rollups of the animals concerned.
+        """
+        milked = set()
+        for batch in chunks(enumerate(rows, 1), self.batch_size):
+            self._resolve(row.get('animal') for line, row in batch)
+            milkings = []
+            for line, row in batch:
+                try:
+                    milkings.append(self.parse_milking(row))
+                except (ValueError, TypeError), e:
+                    self.errors.append((line, unicode(e)))
+            if not self.dry_run:
+                with transaction.commit_on_success():
+                    Milking.objects.bulk_create(milkings)
+                milked.update(m.animal_id for m in milkings)
+            self.count += len(milkings)
+        MilkingRollup.objects.rebuild(milked)
+        bump('stats')
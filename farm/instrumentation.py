@@ -0,0 +1,152 @@
+"""
+Per-request query and timing instrumentation for the farm views and tags.
+
+Turned on with FARM_INSTRUMENTATION = True in the settings together with
+farm.middleware.InstrumentationMiddleware. Each request records its query
+count, duplicated queries, SQL time, render time and total time, and the
+time and queries of every instrumented template tag. Totals per view and tag
+are kept in process and flushed to the cache every FARM_INSTRUMENTATION_FLUSH
+requests, so the stats view and the farm_instrumentation command can merge
+the numbers of every process.
+
+When disabled the middleware removes itself and timed() returns the tag
+functions untouched.
+"""
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+ENABLED = getattr(settings, 'FARM_INSTRUMENTATION', False)
+FLUSH_EVERY = getattr(settings, 'FARM_INSTRUMENTATION_FLUSH', 50)
+FIELDS = ('count', 'queries', 'duplicates', 'sql_time', 'render_time', 'total_time')
+# Django 1.4 caches read a timeout of None as the default timeout, so the
+# totals are kept for an explicit 30 days, memcached's longest.
+TIMEOUT = getattr(settings, 'FARM_INSTRUMENTATION_TIMEOUT', 60 * 60 * 24 * 30)
+PROCESSES_KEY = 'farm:instrumentation:processes'
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {}
+_unflushed = [0]
+_slot = [None]
+
+class Record(object):
+    """Measurements of one request, ended by finish()."""
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.render_started = None
+        self.first_query = len(connection.queries)
+        self.tags = {}
+
+    def add_tag(self, name, seconds, queries):
+        tag = self.tags.setdefault(name, {'count': 0, 'queries': 0, 'total_time': 0.0})
+        tag['count'] += 1
+        tag['queries'] += queries
+        tag['total_time'] += seconds
+
+    def summary(self):
+        now = time.time()
+        queries = connection.queries[self.first_query:]
+        statements = [q['sql'] for q in queries]
+        return {
+            'count': 1,
+            'queries': len(queries),
+            'duplicates': len(statements) - len(set(statements)),
+            'sql_time': sum(float(q['time']) for q in queries),
+            'render_time': now - self.render_started if self.render_started else 0.0,
+            'total_time': now - self.started,
+        }
+
+def start(name):
+    _local.record = Record(name)
+    return _local.record
+
+def current():
+    return getattr(_local, 'record', None)
+
+def finish():
+    """Ends the current request's record, adds it to the totals and returns its summary."""
+    record = current()
+    if record is None:
+        return None
+    _local.record = None
+    summary = record.summary()
+    with _lock:
+        _add(record.name, summary)
+        for name, tag in record.tags.iteritems():
+            _add('tag:%s' % name, tag)
+        _unflushed[0] += 1
+        if _unflushed[0] >= FLUSH_EVERY:
+            flush()
+    return summary
+
+def _add(name, values):
+    totals = _stats.setdefault(name, dict.fromkeys(FIELDS, 0))
+    for key, value in values.iteritems():
+        totals[key] += value
+
+def stats():
+    """Totals per view and tag of this process."""
+    with _lock:
+        return dict((name, dict(totals)) for name, totals in _stats.iteritems())
+
+def _key(slot):
+    return 'farm:instrumentation:%s' % slot
+
+def flush():
+    """
+    Publishes this process's totals to the cache, under a slot numbered by
+    an atomic increment of PROCESSES_KEY, so processes never overwrite each
+    other's registration.
+    """
+    if _slot[0] is None:
+        cache.add(PROCESSES_KEY, 0, TIMEOUT)
+        try:
+            _slot[0] = cache.incr(PROCESSES_KEY)
+        except ValueError:
+            # The counter was evicted between add() and incr().
+            cache.add(PROCESSES_KEY, 0, TIMEOUT)
+            _slot[0] = cache.incr(PROCESSES_KEY)
+    else:
+        # Recreates an evicted counter past this process's slot.
+        cache.add(PROCESSES_KEY, _slot[0], TIMEOUT)
+    cache.set(_key(_slot[0]), dict((name, dict(totals)) for name, totals in _stats.iteritems()), TIMEOUT)
+    _unflushed[0] = 0
+
+def collected():
+    """Totals per view and tag merged over every process that flushed."""
+    merged = {}
+    snapshots = cache.get_many([_key(slot) for slot in range(1, (cache.get(PROCESSES_KEY) or 0) + 1)])
+    for snapshot in snapshots.itervalues():
+        for name, totals in snapshot.iteritems():
+            merged_totals = merged.setdefault(name, dict.fromkeys(FIELDS, 0))
+            for key, value in totals.iteritems():
+                merged_totals[key] += value
+    return merged
+
+def timed(name):
+    """
+    Decorates a template tag's render function (or any function) to record
+    its time and queries in the current request.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            record = current()
+            if record is None:
+                return func(*args, **kwargs)
+            first = len(connection.queries)
+            started = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record.add_tag(name, time.time() - started, len(connection.queries) - first)
+        return wrapper
+    return decorator
@@ -0,0 +1,32 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from farm.exporter import EXPORTS, export_lines
+
+class Command(BaseCommand):
+    args = '<animals|milkings|products>'
+    help = 'Exports animals, milkings or products as a CSV or JSON-lines file, importable with import_herd.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+            help='File format, csv or jsonl. Defaults to csv.'),
+        make_option('--output', dest='output', default=None,
+            help='File to write to. Defaults to standard output.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help='Rows read per query.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or args[0] not in EXPORTS:
+            raise CommandError('Usage: export_herd %s' % self.args)
+        if options['format'] not in ('csv', 'jsonl'):
+            raise CommandError('Unknown format %s' % options['format'])
+
+        stream = open(options['output'], 'wb') if options['output'] else sys.stdout
+        try:
+            for line in export_lines(args[0], options['format'], batch_size=options['batch_size']):
+                stream.write(line)
+        finally:
+            if options['output']:
+                stream.close()
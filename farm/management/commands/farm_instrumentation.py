@@ -0,0 +1,26 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from farm import instrumentation
+
+class Command(BaseCommand):
+    help = 'Shows the request instrumentation totals every process flushed to the cache.'
+    option_list = BaseCommand.option_list + (
+        make_option('--sort', dest='sort', default='sql_time',
+            help='Column to sort by: count, queries, duplicates, sql_time, render_time or total_time.'),
+    )
+
+    def handle(self, *args, **options):
+        stats = instrumentation.collected()
+        if not stats:
+            self.stdout.write('No instrumentation recorded. Is FARM_INSTRUMENTATION on?\n')
+            return
+
+        self.stdout.write('%-60s %8s %9s %9s %10s %10s %10s\n' % ('view / tag', 'count', 'queries/r', 'dupes/r',
+                'sql ms/r', 'render ms/r', 'total ms/r'))
+        for name, totals in sorted(stats.iteritems(), key=lambda item: -item[1].get(options['sort'], 0)):
+            count = float(totals['count']) or 1
+            self.stdout.write('%-60s %8d %9.1f %9.1f %10.1f %10.1f %10.1f\n' % (name[-60:], totals['count'],
+                    totals['queries'] / count, totals['duplicates'] / count, totals['sql_time'] * 1000 / count,
+                    totals['render_time'] * 1000 / count, totals['total_time'] * 1000 / count))
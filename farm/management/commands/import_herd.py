@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from farm.importer import HerdImporter, read_rows
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = 'Imports animals (or milkings) from a CSV or JSON-lines file.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+            help='File format, csv or jsonl. Defaults to csv.'),
+        make_option('--milkings', action='store_true', dest='milkings', default=False,
+            help='The file holds milkings rather than animals.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help='Rows written per bulk insert and transaction.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only validate the file, writing nothing.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: import_herd %s' % self.args)
+
+        importer = HerdImporter(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        with open(args[0], 'rb') as stream:
+            rows = read_rows(stream, options['format'])
+            if options['milkings']:
+                importer.import_milkings(rows)
+            else:
+                importer.import_animals(rows)
+
+        for line, message in importer.errors:
+            self.stderr.write('Row %s: %s\n' % (line, message))
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write('%s %s rows with %s errors.\n' % (verb, importer.count, len(importer.errors)))
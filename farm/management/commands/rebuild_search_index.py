@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from farm import search
+from farm.models import SearchEntry
+
+class Command(NoArgsCommand):
+    help = 'Recreates the search entries of every animal, product, building and field.'
+
+    def handle_noargs(self, **options):
+        search.rebuild()
+        self.stdout.write('Indexed %s objects.\n' % SearchEntry.objects.count())
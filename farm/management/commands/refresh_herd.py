@@ -0,0 +1,36 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from django.db.models import F
+
+from farm import search
+from farm.caching import bump
+from farm.models import Animal, AnimalAncestry, Litter, Milking, MilkingRollup, UNIT_MILLILITERS
+from farm.pedigree import refresh_inbreeding
+
+class Command(NoArgsCommand):
+    help = ('Recomputes every stored summary of the herd: milking quantities in ml, ancestry, breed labels, '
+            'inbreeding, litters, the on-the-farm flag, milking rollups and the search index. Run it after '
+            'upgrading, or after writing to the farm tables without the models.')
+
+    def handle_noargs(self, **options):
+        steps = (
+            ('milking quantities', self.normalize_milkings),
+            ('ancestry', AnimalAncestry.objects.rebuild),
+            ('breed labels', Animal.objects.refresh_breeds),
+            ('inbreeding', refresh_inbreeding),
+            ('litters', lambda: Litter.objects.rebuild(
+                    Animal.objects.filter(dam__isnull=False).values_list('dam', flat=True).order_by().distinct())),
+            ('on the farm', Animal.objects.refresh_on_farm),
+            ('milking rollups', lambda: MilkingRollup.objects.rebuild(
+                    Milking.objects.values_list('animal', flat=True).order_by().distinct())),
+            ('search index', search.rebuild),
+        )
+        for name, step in steps:
+            with transaction.commit_on_success():
+                step()
+            self.stdout.write('Refreshed %s.\n' % name)
+        bump('tags', 'stats', 'detail', 'pedigree')
+
+    def normalize_milkings(self):
+        for units, milliliters in UNIT_MILLILITERS.iteritems():
+            Milking.objects.filter(units=units).update(quantity_ml=F('quantity') * milliliters)
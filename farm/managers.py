@@ -1,7 +1,566 @@
-from django.db.models import Manager
-from datetime import datetime
+import operator
+import re
+from collections import namedtuple
+from datetime import date, timedelta
+from uuid import uuid4
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, connections, transaction
+from django.db.models import Count, F, Manager, Q
+from django.db.models.query import QuerySet
+from django.template.defaultfilters import slugify
+
+from farm.caching import bump, object_namespace
+from farm.utils import chunks, group_litters, topological_order
+
+Birth = namedtuple('Birth', 'dam sire birthday deathday')
+
+# Shortest uuid prefix an animal can be looked up by.
+UUID_PREFIX = 4
+
+# Age in days at death or today, per database vendor.
+AGE_SQL = {
+    'sqlite': "CAST(julianday(COALESCE(%(table)s.deathday, date('now'))) - julianday(%(table)s.birthday) AS INTEGER)",
+    'postgresql': "(COALESCE(%(table)s.deathday, CURRENT_DATE) - %(table)s.birthday)",
+    'mysql': "DATEDIFF(COALESCE(%(table)s.deathday, CURDATE()), %(table)s.birthday)",
+    'oracle': "(TRUNC(NVL(%(table)s.deathday, SYSDATE)) - %(table)s.birthday)",
+}
+
+class AnimalQuerySet(QuerySet):
+    def with_age(self):
+        """
+        Annotates age_days, the age at death or today computed by the
+        database, so animals can be ordered by it: with_age().order_by('age_days').
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        return self.extra(select={'age_days': AGE_SQL[connection.vendor] % {'table': table}})
+
+    def of_age_class(self, age_class):
+        """
+        Filters living animals on their 'kid', 'yearling' or 'adult' class,
+        using birthday ranges derived from each genus's thresholds.
+        """
+        genus_model = self.model._meta.get_field('primary_breed').rel.to._meta.get_field('genus').rel.to
+        today = date.today()
+        conditions = []
+        for pk, yearling_age, adult_age in genus_model.objects.values_list('pk', 'yearling_age', 'adult_age'):
+            yearling = today - timedelta(days=yearling_age)
+            adult = today - timedelta(days=adult_age)
+            if age_class == 'kid':
+                condition = Q(birthday__gt=yearling)
+            elif age_class == 'yearling':
+                condition = Q(birthday__lte=yearling, birthday__gt=adult)
+            elif age_class == 'adult':
+                condition = Q(birthday__lte=adult)
+            else:
+                raise ValueError('Unknown age class %s' % age_class)
+            conditions.append(Q(primary_breed__genus=pk) & condition)
+        if not conditions:
+            return self.none()
+        return self.filter(reduce(operator.or_, conditions), deathday__isnull=True)
+
+    def for_display(self):
+        """
+        Fetches the related rows that Animal's display properties and
+        get_absolute_url() read, so listing animals costs a fixed number of
+        queries however many there are.
+        """
+        return self.select_related('primary_breed__genus', 'dam', 'owner_farm', 'breeder_farm').prefetch_related(
+                'animalregistration_set__body', 'notes')
+
+# Row count estimates from the table statistics, per database vendor.
+ESTIMATE_SQL = {
+    'postgresql': 'SELECT reltuples FROM pg_class WHERE relname = %s',
+    'mysql': 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+}
+
+class EstimatedCountQuerySet(QuerySet):
+    """
+    QuerySet whose count() of a whole large table is read from the database
+    statistics instead of a COUNT(*) scan, for admin changelists. Filtered
+    counts, small tables and databases without statistics count exactly.
+    """
+    threshold = 10000
+
+    def count(self):
+        connection = connections[self.db]
+        if connection.vendor in ESTIMATE_SQL and not self.query.where and not self.query.extra and \
+                self.query.low_mark == 0 and self.query.high_mark is None:
+            cursor = connection.cursor()
+            cursor.execute(ESTIMATE_SQL[connection.vendor], [self.model._meta.db_table])
+            row = cursor.fetchone()
+            if row and row[0] >= self.threshold:
+                return int(row[0])
+        return super(EstimatedCountQuerySet, self).count()
+
+class AnimalManager(Manager):
+    def get_query_set(self):
+        return AnimalQuerySet(self.model, using=self._db)
+
+    def for_display(self):
+        return self.get_query_set().for_display()
+
+    def with_age(self):
+        return self.get_query_set().with_age()
+
+    def of_age_class(self, age_class):
+        return self.get_query_set().of_age_class(age_class)
+
+    def refresh_on_farm(self):
+        """Recomputes the on_farm flag of every animal."""
+        self.filter(on_farm=True).update(on_farm=False)
+        self.filter(owner_farm__active=True, deathday__isnull=True).update(on_farm=True)
+
+    def _secondary_breeds(self, animal_ids):
+        """Returns a dict of animal id to its (breed title, percentage) pairs."""
+        secondary_model = self.model._meta.get_field('secondary_breeds').rel.to
+        animal_type = ContentType.objects.get_for_model(self.model)
+        secondary = {}
+        for batch in chunks(animal_ids, 500):
+            for pk, title, percentage in secondary_model.objects.filter(content_type=animal_type,
+                    object_id__in=batch).order_by('-percentage').values_list('object_id', 'breed__title', 'percentage'):
+                secondary.setdefault(pk, []).append((title, percentage))
+        return secondary
+
+    def _summary(self, title, genus, secondary):
+        label = u'%s %s' % (title, genus)
+        composition = [(title, 100 - sum(percentage for t, percentage in secondary))] + secondary
+        composition = u', '.join(u'%s %s%%' % part for part in composition)
+        if secondary:
+            label = u'Mixed ' + label
+        return label, composition, bool(secondary)
+
+    def breed_summary(self, animal):
+        """
+        Returns the (breed_label, breed_composition, is_mixed) an animal
+        should store, e.g. ('Mixed Nubian Goat', 'Nubian 75%, Alpine 25%', True).
+        """
+        breed_model = self.model._meta.get_field('primary_breed').rel.to
+        title, genus = breed_model.objects.filter(pk=animal.primary_breed_id).values_list('title', 'genus__title')[0]
+        secondary = self._secondary_breeds([animal.pk]).get(animal.pk, []) if animal.pk else []
+        return self._summary(title, genus, secondary)
+
+    def refresh_breeds(self, animal_ids=None):
+        """
+        Recomputes the stored breed summary of the given animals, or of every
+        animal, writing only the rows that changed.
+        """
+        if animal_ids is None:
+            animal_ids = self.values_list('pk', flat=True).iterator()
+        for batch in chunks(set(animal_ids), 500):
+            secondary = self._secondary_breeds(batch)
+            changed = {}
+            for pk, title, genus, label, composition, is_mixed in self.filter(pk__in=batch).values_list('pk',
+                    'primary_breed__title', 'primary_breed__genus__title', 'breed_label', 'breed_composition', 'is_mixed'):
+                summary = self._summary(title, genus, secondary.get(pk, []))
+                if summary != (label, composition, is_mixed):
+                    changed.setdefault(summary, []).append(pk)
+            # One UPDATE per distinct summary rather than per animal.
+            for (label, composition, is_mixed), pks in changed.iteritems():
+                self.filter(pk__in=pks).update(breed_label=label, breed_composition=composition, is_mixed=is_mixed)
+
+    def litters_for(self, parents):
+        """
+        Groups the progeny of many dams or sires into litters at once, for
+        herd reports. Returns a dict of parent id to the SortedDict that
+        Animal.litters() would give, using a fixed number of queries: the
+        children come with everything for_display() fetches.
+        """
+        ids = [getattr(p, 'pk', p) for p in parents]
+        windows = dict(self.filter(pk__in=ids).values_list('pk', 'primary_breed__genus__litter_window'))
+        progeny = dict((pk, []) for pk in ids)
+        for child in self.for_display().filter(Q(dam__in=ids) | Q(sire__in=ids), birthday__isnull=False).order_by(
+                'birthday', 'birthtime', 'pk'):
+            for parent in set([child.dam_id, child.sire_id]):
+                if parent in progeny:
+                    progeny[parent].append(child)
+        return dict((pk, group_litters(children, timedelta(days=windows.get(pk, 1))))
+                for pk, children in progeny.iteritems())
+
+    def assign_slugs(self, animals):
+        """
+        Gives a batch of unsaved animals the uuid and unique slug that save()
+        would, checking the whole batch against the table with one query per
+        500 distinct names.
+        Use before bulk_create.
+        """
+        max_length = self.model._meta.get_field('slug').max_length
+        named = []
+        for animal in animals:
+            if not animal.uuid:
+                animal.uuid = uuid4().hex
+            base = slugify(animal.name or '')[:max_length].strip('-')
+            if base:
+                named.append((animal, base))
+            else:
+                animal.slug = animal.uuid
+        if not named:
+            return
+
+        # Prefix lookups can use the slug index, unlike a regex; the
+        # matches are narrowed to base and base-N here.
+        bases = set(base for animal, base in named)
+        pattern = re.compile(r'^(%s)(-[0-9]+)?$' % '|'.join(re.escape(base) for base in bases))
+        taken = set()
+        for batch in chunks(bases, 500):
+            prefixes = reduce(operator.or_, [Q(slug__startswith=base) for base in batch])
+            taken.update(slug for slug in self.filter(prefixes).values_list('slug', flat=True) if pattern.match(slug))
+        for animal, base in named:
+            slug, counter = base, 2
+            while slug in taken:
+                suffix = '-%d' % counter
+                slug = base[:max_length - len(suffix)] + suffix
+                counter += 1
+            taken.add(slug)
+            animal.slug = slug
+
+class OnTheFarmManager(AnimalManager):
+    """
+    Living animals owned by an active farm, read from the denormalized
+    Animal.on_farm flag so no join to Farm is needed.
+    """
+    def get_query_set(self):
+        return super(OnTheFarmManager, self).get_query_set().filter(on_farm=True)
+
+class AncestryManager(Manager):
+    """
+    Maintains the materialized dam/sire closure stored in AnimalAncestry.
+    """
+    batch_size = 500
+
+    def rebuild(self, animal_ids=None):
+        """
+        Recomputes the ancestry rows of the given animals and of all their
+        descendants. Without animal_ids the whole table is rebuilt.
+
+        The pedigree is read with a fixed number of queries whatever its size
+        and the new rows are written with bulk_create.
+        """
+        animal_model = self.model._meta.get_field('descendant').rel.to
+        lineage = {}
+
+        if animal_ids is None:
+            parents = dict((pk, (dam, sire)) for pk, dam, sire in
+                    animal_model.objects.values_list('pk', 'dam', 'sire').iterator())
+            cursor = connection.cursor()
+            cursor.execute('DELETE FROM %s' % connection.ops.quote_name(self.model._meta.db_table))
+        else:
+            affected = set(animal_ids)
+            for batch in chunks(list(affected), self.batch_size):
+                affected.update(self.filter(ancestor__in=batch).values_list('descendant', flat=True))
+            parents = {}
+            for batch in chunks(affected, self.batch_size):
+                parents.update((pk, (dam, sire)) for pk, dam, sire in
+                        animal_model.objects.filter(pk__in=batch).values_list('pk', 'dam', 'sire'))
+            outside = set(p for pair in parents.itervalues() for p in pair if p and p not in parents)
+            for batch in chunks(outside, self.batch_size):
+                for ancestor, descendant, depth, path in self.filter(descendant__in=batch).values_list(
+                        'ancestor', 'descendant', 'depth', 'path'):
+                    lineage.setdefault(descendant, {})[(ancestor, depth)] = path
+            for batch in chunks(parents.keys(), self.batch_size):
+                self.filter(descendant__in=batch).delete()
+
+        rows = []
+        for pk in topological_order(parents):
+            links = {}
+            # The dam is walked first so her side wins when an ancestor is
+            # reachable through both parents at the same depth.
+            for code, parent in zip('DS', parents[pk]):
+                if not parent:
+                    continue
+                links.setdefault((parent, 1), code)
+                for (ancestor, depth), path in lineage.get(parent, {}).iteritems():
+                    links.setdefault((ancestor, depth + 1), code + path)
+            lineage[pk] = links
+            for (ancestor, depth), path in links.iteritems():
+                rows.append(self.model(ancestor_id=ancestor, descendant_id=pk, depth=depth, path=path))
+
+        for batch in chunks(rows, self.batch_size):
+            self.bulk_create(batch)
+        return parents.keys()
+
+class LitterManager(Manager):
+    """
+    Assigns animals to stored litters and keeps the litter counts current.
+    """
+    def for_birth(self, animal):
+        """
+        Returns the litter an animal belongs to from its dam and birthday,
+        creating one when no litter of the dam is within the genus window.
+        """
+        if not (animal.dam_id and animal.birthday):
+            return None
+        breed_model = animal._meta.get_field('primary_breed').rel.to
+        window = timedelta(days=breed_model.objects.filter(pk=animal.primary_breed_id).values_list(
+                'genus__litter_window', flat=True)[0])
+        try:
+            return self.filter(dam=animal.dam_id, start__lte=animal.birthday + window,
+                    end__gte=animal.birthday - window).order_by('start')[0]
+        except IndexError:
+            return self.create(dam_id=animal.dam_id, sire_id=animal.sire_id, start=animal.birthday,
+                    end=animal.birthday)
+
+    def refresh(self, litter_ids):
+        """
+        Recounts the given litters from their animals, deleting the ones left
+        empty.
+        """
+        animal_model = self.model._meta.get_field('dam').rel.to
+        for pk in set(filter(None, litter_ids)):
+            births = list(animal_model.objects.filter(litter=pk).values_list('birthday', 'deathday', 'sire'))
+            if not births:
+                self.filter(pk=pk).delete()
+                continue
+            days = [birthday for birthday, deathday, sire in births]
+            self.filter(pk=pk).update(start=min(days), end=max(days), size=len(births),
+                    born_alive=len([1 for birthday, deathday, sire in births if deathday != birthday]),
+                    lost=len([1 for birthday, deathday, sire in births if deathday]),
+                    sire=([sire for birthday, deathday, sire in births if sire] or [None])[0])
+
+    def rebuild(self, dam_ids):
+        """
+        Regroups every birth of the given dams into fresh litter rows, for
+        animals written without Animal.save(). The litters are counted in
+        memory, written with bulk_create and assigned to their animals with
+        one UPDATE, so the queries grow with the number of dams / 500 only.
+        """
+        for batch in chunks(set(dam_ids), 500):
+            self._rebuild(batch)
+
+    def _rebuild(self, dam_ids):
+        animal_model = self.model._meta.get_field('dam').rel.to
+        windows = dict(animal_model.objects.filter(pk__in=dam_ids).values_list('pk', 'primary_breed__genus__litter_window'))
+        births = dict((pk, []) for pk in dam_ids)
+        for birth in animal_model.objects.filter(dam__in=dam_ids, birthday__isnull=False).order_by(
+                'birthday', 'birthtime', 'pk').values_list('dam', 'sire', 'birthday', 'deathday'):
+            births[birth[0]].append(Birth(*birth))
+
+        litters = []
+        for dam, rows in births.iteritems():
+            for start, animals in group_litters(rows, timedelta(days=windows.get(dam, 1))).iteritems():
+                litters.append(self.model(dam_id=dam, start=start, end=animals[-1].birthday, size=len(animals),
+                        born_alive=len([1 for a in animals if a.deathday != a.birthday]),
+                        lost=len([1 for a in animals if a.deathday]),
+                        sire_id=([a.sire for a in animals if a.sire] or [None])[0]))
+        self.filter(dam__in=dam_ids).delete()
+        self.bulk_create(litters)
+
+        # A dam's litters never overlap, so each birth falls within one.
+        qn = connection.ops.quote_name
+        column = lambda model, name: qn(model._meta.get_field(name).column)
+        sql = ('UPDATE %(animals)s SET %(litter)s = (SELECT l.%(id)s FROM %(litters)s l WHERE l.%(dam)s = %(animals)s.%(dam)s '
+                'AND l.%(start)s <= %(animals)s.%(birthday)s AND l.%(end)s >= %(animals)s.%(birthday)s) '
+                'WHERE %(animals)s.%(dam)s IN (%(params)s) AND %(animals)s.%(birthday)s IS NOT NULL') % {
+                    'animals': qn(animal_model._meta.db_table), 'litters': qn(self.model._meta.db_table),
+                    'litter': column(animal_model, 'litter'), 'dam': column(animal_model, 'dam'),
+                    'birthday': column(animal_model, 'birthday'), 'id': column(self.model, 'id'),
+                    'start': column(self.model, 'start'), 'end': column(self.model, 'end'),
+                    'params': ', '.join(['%s'] * len(dam_ids))}
+        connection.cursor().execute(sql, dam_ids)
+        transaction.commit_unless_managed()
+
+class MilkingRollupManager(Manager):
+    """
+    Maintains the per animal day, week and lactation milk totals.
+    """
+    def _lactations(self, animal_ids, last=None):
+        """Returns a dict of animal id to the start dates of its litters."""
+        litter_model = self.model._meta.get_field('animal').rel.to._meta.get_field('litter').rel.to
+        lactations = {}
+        for batch in chunks(animal_ids, 500):
+            litters = litter_model.objects.filter(dam__in=batch)
+            if last is not None:
+                litters = litters.filter(start__lte=last)
+            for dam, start in litters.values_list('dam', 'start'):
+                lactations.setdefault(dam, []).append(start)
+        return lactations
+
+    def _buckets(self, rows, lactations, sign=1):
+        """
+        Sums (animal_id, milking_time, quantity_ml) rows into a dict of
+        (animal_id, period, start) to [quantity_ml, milkings].
+        """
+        buckets = {}
+        for animal, time, quantity in rows:
+            day = time.date()
+            starts = [('d', day), ('w', day - timedelta(days=day.weekday()))]
+            litters = [start for start in lactations.get(animal, ()) if start <= day]
+            if litters:
+                starts.append(('l', max(litters)))
+            for period, start in starts:
+                bucket = buckets.setdefault((animal, period, start), [0.0, 0])
+                bucket[0] += sign * quantity
+                bucket[1] += sign
+        return buckets
+
+    def apply(self, rows, sign=1):
+        """
+        Adds (or with sign=-1 removes) (animal_id, milking_time, quantity_ml)
+        rows to the rollups, with one read per period and one write per
+        touched rollup.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        lactations = self._lactations(set(row[0] for row in rows), max(row[1] for row in rows).date())
+        buckets = self._buckets(rows, lactations, sign)
+        existing = {}
+        for period in set(key[1] for key in buckets):
+            keys = [key for key in buckets if key[1] == period]
+            for pk, animal, start in self.filter(period=period, animal__in=set(k[0] for k in keys),
+                    start__in=set(k[2] for k in keys)).values_list('pk', 'animal', 'start'):
+                existing[(animal, period, start)] = pk
+
+        new = []
+        for key, (quantity, milkings) in buckets.iteritems():
+            if key in existing:
+                self.filter(pk=existing[key]).update(quantity_ml=F('quantity_ml') + quantity,
+                        milkings=F('milkings') + milkings)
+            else:
+                new.append(self.model(animal_id=key[0], period=key[1], start=key[2], quantity_ml=quantity,
+                        milkings=milkings))
+        self.bulk_create(new)
+
+    def rebuild(self, animal_ids):
+        """Recomputes every rollup of the given animals from their milkings."""
+        milking_model = self.model._meta.get_field('animal').rel.to._meta.get_field_by_name('milking')[0].model
+        for batch in chunks(animal_ids, 500):
+            self.filter(animal__in=batch).delete()
+            rows = milking_model.objects.filter(animal__in=batch).values_list(
+                    'animal', 'milking_time', 'quantity_ml').iterator()
+            buckets = self._buckets(rows, self._lactations(batch))
+            for new in chunks(buckets.iteritems(), 500):
+                self.bulk_create([self.model(animal_id=key[0], period=key[1], start=key[2], quantity_ml=quantity,
+                        milkings=milkings) for key, (quantity, milkings) in new])
+
+class MilkingManager(Manager):
+    def _resolve(self, keys):
+        """
+        Maps slugs and uuid prefixes of at least UUID_PREFIX characters to
+        animal pks, with one query per batch. Ambiguous prefixes map to None.
+        """
+        animal_model = self.model._meta.get_field('animal').rel.to
+        found = {}
+        for batch in chunks(set(keys), 200):
+            prefixes = [key for key in batch if len(key) >= UUID_PREFIX]
+            lookups = [Q(slug__in=batch)] + [Q(uuid__startswith=key.lower()) for key in prefixes]
+            slugs, uuids = {}, {}
+            for pk, slug, uuid in animal_model.objects.filter(reduce(operator.or_, lookups)).values_list(
+                    'pk', 'slug', 'uuid'):
+                slugs[slug] = pk
+                for key in prefixes:
+                    if uuid.startswith(key.lower()):
+                        uuids.setdefault(key, set()).add(pk)
+            for key in batch:
+                if key in slugs:
+                    found[key] = slugs[key]
+                elif key in uuids:
+                    found[key] = uuids[key].pop() if len(uuids[key]) == 1 else None
+        return found
+
+    def record_session(self, rows, milking_time):
+        """
+        Records a parlor session: rows of dicts with animal (slug or uuid
+        prefix), quantity and units, all milked at milking_time.
+
+        Returns (milkings, errors) with errors a list of (row number, message).
+        The session is written, with its rollups, in one transaction and only
+        when every row is valid, so a corrected session can be posted again.
+        """
+        rows = list(rows)
+        keys = [unicode(row.get('animal') or '').strip() for row in rows]
+        animals = self._resolve(key for key in keys if key)
+        units = dict(self.model._meta.get_field('units').choices)
+        milkings, errors, seen = [], [], set()
+        for number, (key, row) in enumerate(zip(keys, rows), 1):
+            try:
+                if not key:
+                    raise ValueError('Missing animal')
+                if animals.get(key) is None:
+                    raise ValueError('%s animal %s' % ('Ambiguous' if key in animals else 'Unknown', key))
+                if animals[key] in seen:
+                    raise ValueError('Animal %s is listed twice' % key)
+                milking = self.model(animal_id=animals[key], milking_time=milking_time,
+                        quantity=int(row.get('quantity')), units=row.get('units') or 'ml')
+                if milking.quantity <= 0:
+                    raise ValueError('Quantity must be positive')
+                if milking.units not in units:
+                    raise ValueError('Unknown units %s' % milking.units)
+            except (ValueError, TypeError), e:
+                errors.append((number, unicode(e)))
+                continue
+            seen.add(milking.animal_id)
+            milking.normalize()
+            milkings.append(milking)
+
+        if errors or not milkings:
+            return [], errors
+        rollups = self.model._meta.get_field('animal').rel.to._meta.get_field_by_name('milk_rollups')[0].model
+        with transaction.commit_on_success(using=self.db):
+            self.bulk_create(milkings)
+            rollups.objects.apply(m.rollup_row for m in milkings)
+        animal_model = self.model._meta.get_field('animal').rel.to
+        bump('stats', *[object_namespace(animal_model, m.animal_id) for m in milkings])
+        return milkings, errors
+
+# Matches search terms against the entries' title and text, per database
+# vendor; the full-text indexes are created by the sql/searchentry.*.sql files.
+SEARCH_SQL = {
+    'sqlite': ('%(table)s.id IN (SELECT rowid FROM farm_searchentry_fts WHERE farm_searchentry_fts MATCH %%s)',
+        lambda terms: ' '.join('"%s"*' % term for term in terms)),
+    'postgresql': ("to_tsvector('simple', %(table)s.title || ' ' || %(table)s.text) @@ to_tsquery('simple', %%s)",
+        lambda terms: ' & '.join('%s:*' % term for term in terms)),
+}
+
+class SearchEntryQuerySet(QuerySet):
+    def matching(self, query):
+        """
+        Entries containing every word of query, words matching as prefixes
+        so uuid prefixes find their animal. Uses the database's full-text
+        index where there is one, substring matching otherwise.
+        """
+        terms = re.findall(r'\w+', query.lower(), re.U)
+        if not terms:
+            return self
+        connection = connections[self.db]
+        if connection.vendor in SEARCH_SQL and self.model.objects.has_full_text(self.db):
+            where, make_query = SEARCH_SQL[connection.vendor]
+            table = connection.ops.quote_name(self.model._meta.db_table)
+            return self.extra(where=[where % {'table': table}], params=[make_query(terms)])
+        return self.filter(reduce(operator.and_, (Q(title__icontains=term) | Q(text__icontains=term) for term in terms)))
+
+    def facets(self):
+        """
+        Counts of the entries per genus, breed, sex and farm, as lists of
+        (value, label, count) sorted by label.
+        """
+        facets = {}
+        for name in ('genus', 'breed', 'farm'):
+            rows = self.exclude(**{name: None}).values_list(name, '%s__title' % name).annotate(
+                    count=Count('pk')).order_by('%s__title' % name)
+            facets[name] = list(rows)
+        facets['sex'] = [(sex, sex, count) for sex, count in
+                self.exclude(sex='').values_list('sex').annotate(count=Count('pk')).order_by('sex')]
+        return facets
+
+class SearchEntryManager(Manager):
+    _full_text = {}
 
-class OnTheFarmManager(Manager):
     def get_query_set(self):
-        return super(OnTheFarmManager, self).get_query_set().filter(owner_farm__active=True).filter(deathday__isnull=True)
+        return SearchEntryQuerySet(self.model, using=self._db)
+
+    def matching(self, query):
+        return self.get_query_set().matching(query)
 
+    def has_full_text(self, using):
+        """Whether the full-text index of the database exists, checked once per process."""
+        if using not in self._full_text:
+            connection = connections[using]
+            if connection.vendor == 'sqlite':
+                cursor = connection.cursor()
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'farm_searchentry_fts'")
+                self._full_text[using] = cursor.fetchone() is not None
+            else:
+                self._full_text[using] = True
+        return self._full_text[using]
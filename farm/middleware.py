@@ -0,0 +1,45 @@
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from farm import instrumentation
+
+class InstrumentationMiddleware(object):
+    """
+    Records the queries and timings of every request, see farm.instrumentation.
+
+    Adds X-Farm-Queries, X-Farm-Duplicate-Queries, X-Farm-SQL-Time,
+    X-Farm-Render-Time and X-Farm-Total-Time headers (times in ms) to the
+    response. Removes itself unless FARM_INSTRUMENTATION is set.
+    """
+    def __init__(self):
+        if not instrumentation.ENABLED:
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        request._farm_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        instrumentation.start(request.path)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        record = instrumentation.current()
+        if record is not None:
+            record.name = '%s.%s' % (view_func.__module__, getattr(view_func, '__name__', view_func.__class__.__name__))
+
+    def process_template_response(self, request, response):
+        record = instrumentation.current()
+        if record is not None:
+            record.render_started = time.time()
+        return response
+
+    def process_response(self, request, response):
+        summary = instrumentation.finish()
+        if hasattr(request, '_farm_debug_cursor'):
+            connection.use_debug_cursor = request._farm_debug_cursor
+        if summary is not None:
+            response['X-Farm-Queries'] = str(summary['queries'])
+            response['X-Farm-Duplicate-Queries'] = str(summary['duplicates'])
+            for key, header in (('sql_time', 'SQL'), ('render_time', 'Render'), ('total_time', 'Total')):
+                response['X-Farm-%s-Time' % header] = '%.1f' % (summary[key] * 1000)
+        return response
@@ -1,6 +1,7 @@
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+from datetime import date, datetime, timedelta
+from uuid import uuid4
 from django.db import models
+from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.contrib.auth.models import User
@@ -16,8 +17,10 @@ from notes.models import Note
 from attributes.models import BaseAttribute, AttributeOption
 from uuidfield import UUIDField
 
-from farm.utils import get_fancy_time
-from farm.managers import OnTheFarmManager 
+from farm.caching import cached, generation, object_namespace, version
+from farm.utils import format_age
+from farm.managers import AnimalManager, OnTheFarmManager, AncestryManager, LitterManager, MilkingManager, MilkingRollupManager, SearchEntryManager
+from farm.pedigree import offspring_inbreeding, kinships, refresh_inbreeding
 
 class Farm(TitleSlugDescriptionModel, TimeStampedModel, USAddressPhoneMixin):
     """
@@ -35,6 +38,16 @@ class Farm(TitleSlugDescriptionModel, TimeStampedModel, USAddressPhoneMixin):
     def __unicode__(self):
         return u'%s' % self.title
 
+    def __init__(self, *args, **kwargs):
+        super(Farm, self).__init__(*args, **kwargs)
+        self._active = self.active
+
+    def save(self, *args, **kwargs):
+        super(Farm, self).save(*args, **kwargs)
+        if self.active != self._active:
+            Animal.objects.filter(owner_farm=self, deathday__isnull=True).update(on_farm=self.active)
+            self._active = self.active
+
 class Genus(TitleSlugDescriptionModel):
     """
     Genus model class.
@@ -43,6 +56,12 @@ class Genus(TitleSlugDescriptionModel):
     """
     plural_name=models.CharField(_('Plural name'), help_text="Only use if adding an 's' does not work.", blank=True, null=True, max_length=200)
     technical_name=models.CharField(_('Technical title'), blank=True, null=True, max_length=200)
+    litter_window=models.PositiveSmallIntegerField(_('Litter window'), default=1,
+            help_text='Days allowed between two births of the same litter.')
+    yearling_age=models.PositiveIntegerField(_('Yearling age'), default=180,
+            help_text='Age in days from which an animal is no longer a kid.')
+    adult_age=models.PositiveIntegerField(_('Adult age'), default=365,
+            help_text='Age in days from which an animal is an adult.')
     
         
     class Meta:
@@ -56,6 +75,11 @@ class Genus(TitleSlugDescriptionModel):
     def get_absolute_url(self):
         return ('fm-genus-detail', None, {'slug': self.slug})
 
+    def age_class(self, days):
+        if days < self.yearling_age: return 'kid'
+        elif days < self.adult_age: return 'yearling'
+        else: return 'adult'
+
     @property
     def plural_title(self):
         if self.plural_name: return self.plural_name
@@ -115,7 +139,7 @@ class Animal(MarkupMixin, TimeStampedModel):
             ('M', 'Male'),
             ('F', 'Female'),]
 
-    uuid=UUIDField(auto=True, editable=True)
+    uuid=UUIDField(auto=True, editable=True, db_index=True)
     name = models.CharField(_('Name'), blank=True, null=True, max_length=255)
     slug = models.SlugField(_('Slug'), blank=True)
     primary_breed = models.ForeignKey(Breed)
@@ -132,11 +156,17 @@ class Animal(MarkupMixin, TimeStampedModel):
     rendered_description = models.TextField(_('Rendered description'), blank=True, null=True, editable=False)
     photos=models.ManyToManyField(Photo, blank=True, null=True)
     sex=models.CharField(_('Sex'), choices=SEX_CHOICES, default='f', max_length=1)
+    inbreeding=models.FloatField(_('Inbreeding coefficient'), blank=True, null=True, editable=False)
+    on_farm=models.BooleanField(_('On the farm'), default=False, editable=False, db_index=True)
+    is_mixed=models.BooleanField(_('Mixed breed'), default=False, editable=False, db_index=True)
+    breed_label=models.CharField(_('Breed'), blank=True, max_length=255, editable=False)
+    breed_composition=models.CharField(_('Breed composition'), blank=True, max_length=255, editable=False)
+    litter=models.ForeignKey('Litter', related_name='animals', blank=True, null=True, editable=False, on_delete=models.SET_NULL)
 
     notes=generic.GenericRelation(Note)
     secondary_breeds=generic.GenericRelation('SecondaryBreed')
         
-    objects = models.Manager()
+    objects = AnimalManager()
     onthefarm_objects = OnTheFarmManager()
 
     class Meta:
@@ -147,15 +177,61 @@ class Animal(MarkupMixin, TimeStampedModel):
         source_field = 'description'
         rendered_field = 'rendered_description'
 
-    def save(self, *args, **kwargs):
-        super(Animal, self).save(*args, **kwargs)
+    def clean(self):
+        super(Animal, self).clean()
+        self.check_ancestry()
 
-        if not self.name:
-            self.slug = self.uuid
-        else:
-            unique_slugify(self, self.name)
+    def check_ancestry(self):
+        """Raises ValidationError when the dam or sire descends from the animal."""
+        parents = [p for p in (self.dam_id, self.sire_id) if p]
+        if self.pk and parents:
+            if self.pk in parents or AnimalAncestry.objects.filter(ancestor=self, descendant__in=parents).exists():
+                raise ValidationError(_('An animal cannot be its own ancestor.'))
 
-        super(Animal, self).save()
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        parents = (self.dam_id, self.sire_id)
+        reparented = parents != self._parents or (created and any(parents))
+        if reparented:
+            # Checked before writing, as a cycle would break the ancestry rebuild.
+            self.check_ancestry()
+        if reparented or self.inbreeding is None:
+            self.inbreeding = offspring_inbreeding(self.dam_id, self.sire_id)
+        if created or (self.dam_id, self.birthday) != self._litter_state[:2]:
+            self.litter = Litter.objects.for_birth(self)
+            if self.litter is not None and not self.litter.size:
+                # A new litter opens a lactation for the dam.
+                MilkingRollup.objects.rebuild([self.dam_id])
+        if created or (self.owner_farm_id, self.deathday) != self._on_farm_state:
+            self.on_farm = bool(self.owner_farm_id and self.deathday is None and
+                    Farm.objects.filter(pk=self.owner_farm_id, active=True).exists())
+        if created or self.primary_breed_id != self._primary_breed_id:
+            self.breed_label, self.breed_composition, self.is_mixed = Animal.objects.breed_summary(self)
+        if not self.uuid:
+            self.uuid = uuid4().hex
+        if not self.slug or self.name != self._name:
+            if self.name:
+                unique_slugify(self, self.name)
+            else:
+                self.slug = self.uuid
+        super(Animal, self).save(*args, **kwargs)
+        self._name = self.name
+        self._primary_breed_id = self.primary_breed_id
+        self._on_farm_state = (self.owner_farm_id, self.deathday)
+
+        if reparented:
+            affected = AnimalAncestry.objects.rebuild([self.pk])
+            refresh_inbreeding(pk for pk in affected if pk != self.pk)
+            self._parents = parents
+
+        litter_state = (self.dam_id, self.birthday, self.deathday, self.sire_id, self.litter_id)
+        if litter_state != self._litter_state:
+            Litter.objects.refresh([self._litter_state[-1], self.litter_id])
+            self._litter_state = litter_state
+
+    def delete(self, *args, **kwargs):
+        super(Animal, self).delete(*args, **kwargs)
+        Litter.objects.refresh([self.litter_id])
         
     def __unicode__(self):
         if self.name:
@@ -167,11 +243,14 @@ class Animal(MarkupMixin, TimeStampedModel):
 
     def __init__(self, *args, **kwargs):
         super (Animal, self).__init__(*args, **kwargs)
-        self._mixed_breed = None
         self._registrations = None
-        self._births = []
-        self._litters = {}
+        self._litters = None
         self._age = None
+        self._name = self.name
+        self._primary_breed_id = self.primary_breed_id
+        self._on_farm_state = (self.owner_farm_id, self.deathday)
+        self._parents = (self.dam_id, self.sire_id)
+        self._litter_state = (self.dam_id, self.birthday, self.deathday, self.sire_id, self.litter_id)
 
     @property
     def display_name(self):
@@ -184,33 +263,39 @@ class Animal(MarkupMixin, TimeStampedModel):
 
     @property
     def registrations(self):
-        if not self._registrations:
-            self._registrations = self.registration_set.all()
+        if self._registrations is None:
+            self._registrations = self.animalregistration_set.all()
         return self._registrations
 
+    @property
+    def age_in_days(self):
+        """Age at death or today, taken from with_age() when annotated."""
+        days = getattr(self, 'age_days', None)
+        if days is None and self.birthday:
+            days = ((self.deathday or date.today()) - self.birthday).days
+        return days
+
     @property
     def age(self):
         if not self._age:
             if self.birthday:
-                if self.deathday: DELTA=self.deathday
-                else: DELTA=datetime.now()
-                self._age = get_fancy_time(relativedelta(DELTA, self.birthday), True)
+                self._age = format_age(self.age_in_days)
         return self._age
 
+    @property
+    def age_class(self):
+        """Kid, yearling or adult, from the thresholds of the animal's genus."""
+        days = self.age_in_days
+        if days is None:
+            return None
+        return self.primary_breed.genus.age_class(days)
+
     @property
     def breed(self):
-        if self.mixed_breed():
-            self._breed = 'Mixed ' + self.primary_breed.__unicode__()
-        else:
-            self._breed = self.primary_breed.__unicode__()
-        return self._breed
+        return self.breed_label
 
     def mixed_breed(self):
-        if not self._mixed_breed:
-            if self.secondary_breeds.all():
-                return True
-            else:
-                return False
+        return self.is_mixed
 
     @property
     def location(self):
@@ -222,6 +307,39 @@ class Animal(MarkupMixin, TimeStampedModel):
         if self.breeder_farm: return self.breeder_farm
         else: return self.alt_breeder
 
+    def ancestors(self, depth=None):
+        """
+        Returns every ancestor of the animal, optionally limited to ``depth``
+        generations, with a single query against the ancestry closure.
+        """
+        lookups = {'descendant_links__descendant': self}
+        if depth is not None:
+            lookups['descendant_links__depth__lte'] = depth
+        return Animal.objects.filter(**lookups).distinct()
+
+    def descendants(self, depth=None):
+        """
+        Returns every descendant of the animal, optionally limited to ``depth``
+        generations, with a single query against the ancestry closure.
+        """
+        lookups = {'ancestor_links__ancestor': self}
+        if depth is not None:
+            lookups['ancestor_links__depth__lte'] = depth
+        return Animal.objects.filter(**lookups).distinct()
+
+    def kinship(self, other):
+        """Coefficient of kinship with another animal."""
+        return kinships([(self.pk, other.pk)])[0]
+
+    def milk_production(self, start, end, bucket='d'):
+        """
+        Returns (start, milliliters) pairs for the day ('d'), week ('w') or
+        lactation ('l') buckets starting between start and end, read from the
+        milking rollups.
+        """
+        return list(self.milk_rollups.filter(period=bucket, start__gte=start, start__lte=end).order_by(
+                'start').values_list('start', 'quantity_ml'))
+
     def sire_of(self):
         return Animal.onthefarm_objects.filter(sire=self)
 
@@ -238,47 +356,95 @@ class Animal(MarkupMixin, TimeStampedModel):
         return Animal.objects.filter(models.Q(sire=self)|models.Q(dam=self)).filter(owner_farm__active=True).filter(deathday__isnull=False)
 
     def births(self):
-    # Set the threshold for when births are consider contiguous
-    # Some animals can go hours between births, leading into the next day easily
-        delta = timedelta(days=1)
-        if not self._births:
-            for p in self.progeny():
-                if not p.birthday in self._births:
-                    recorded=False
-                    for b in self._births:
-                        if b+delta >  p.birthday > b-delta:
-                            recorded=True
-                    if not recorded:
-                        self._births.append(p.birthday)
-        return self._births
+        return self.litters().keys()
 
     def litters(self):
-    # Set the threshold for when births are consider contiguous
-    # Some animals can go hours between births, leading into the next day easily
-        delta = timedelta(days=1)
-        if not self._litters:
-            for b in self.births():
-                p_collection=[]
-                for p in self.birthed_progeny():
-                    if b+delta > p.birthday > b-delta:
-                        p_collection.append(p)
-                self._litters[b]=p_collection
+        """
+        Returns a SortedDict of birth date to the progeny born in that
+        litter. Births within the genus litter window of each other count as
+        contiguous, since some animals go hours between births.
+        """
+        if self._litters is None:
+            self._litters = cached(object_namespace(Animal, self.pk), ['litters', generation('detail')],
+                    lambda: Animal.objects.litters_for([self])[self.pk])
         return self._litters
 
+    @property
+    def cache_version(self):
+        """
+        Changes whenever the animal, its children, milkings or notes do, for
+        template fragment caching: {% cache 3600 progeny animal.pk animal.cache_version %}
+        """
+        return '%r' % version(object_namespace(Animal, self.pk))
 
     @models.permalink
     def get_absolute_url(self):
         return ('fm-animal-detail', None, {'slug': self.slug, 'breed_slug': self.primary_breed.slug, 'genus_slug': self.primary_breed.genus.slug})
 
+class AnimalAncestry(models.Model):
+    """
+    Animal ancestry model class.
+
+    Materialized closure of the dam/sire pedigree, kept up to date by
+    Animal.save(). Each row links an animal to one of its ancestors ``depth``
+    generations back; ``path`` spells the route from the descendant, 'D' for
+    a dam and 'S' for a sire. Rows go away with either animal on delete.
+    """
+    ancestor = models.ForeignKey(Animal, related_name='descendant_links')
+    descendant = models.ForeignKey(Animal, related_name='ancestor_links')
+    depth = models.PositiveSmallIntegerField(_('Depth'))
+    path = models.CharField(_('Path'), max_length=255)
+
+    objects = AncestryManager()
+
+    class Meta:
+        verbose_name=_('Animal ancestry')
+        verbose_name_plural=_('Animal ancestries')
+        unique_together = (('descendant', 'ancestor', 'depth'),)
+
+    def __unicode__(self):
+        return u'%s is %s of %s' % (self.ancestor_id, self.path, self.descendant_id)
+
+class Litter(models.Model):
+    """
+    Litter model class.
+
+    A birthing event of a dam, assigned automatically when an animal with a
+    dam and birthday is saved, so litter statistics can be aggregated in SQL.
+    """
+    dam = models.ForeignKey(Animal, related_name='dam_litters')
+    sire = models.ForeignKey(Animal, related_name='sire_litters', blank=True, null=True, on_delete=models.SET_NULL)
+    start = models.DateField(_('First birth'))
+    end = models.DateField(_('Last birth'))
+    size = models.PositiveSmallIntegerField(_('Size'), default=0)
+    born_alive = models.PositiveSmallIntegerField(_('Born alive'), default=0)
+    lost = models.PositiveSmallIntegerField(_('Lost'), default=0)
+
+    objects = LitterManager()
+
+    class Meta:
+        verbose_name=_('Litter')
+        verbose_name_plural=_('Litters')
+        ordering = ('dam', 'start')
+
+    def __unicode__(self):
+        return u'Litter of %s on %s' % (self.dam_id, self.start)
+
 UNIT_CHOICES = ( ('g', 'gallons'), ('l', 'liters' ), ('cl', 'centiliters'), ('ml', 'mililiters'), ('pt', 'pints'), ('oz', 'ounces') )
 
+# Milliliters per unit, US measures.
+UNIT_MILLILITERS = { 'g': 3785.41, 'l': 1000.0, 'cl': 10.0, 'ml': 1.0, 'pt': 473.176, 'oz': 29.5735 }
+
 class Milking(TimeStampedModel):
     animal = models.ForeignKey(Animal)
     milking_time = models.DateTimeField(_('Milking time'))
     quantity = models.IntegerField(_('Quantity'))
     units = models.CharField(_('Units'), choices=UNIT_CHOICES, max_length=2, default='ml')
+    quantity_ml = models.FloatField(_('Quantity in mililiters'), default=0, editable=False)
     notes=generic.GenericRelation(Note)
 
+    objects = MilkingManager()
+
     class Meta:
         verbose_name = _('Milking')
         verbose_name_plural = _('Milkings')
@@ -286,6 +452,57 @@ class Milking(TimeStampedModel):
     def __unicode__(self):
         return u'Milking on %s of %s' %(self.milking_time, self.animal.display_name)
 
+    def __init__(self, *args, **kwargs):
+        super(Milking, self).__init__(*args, **kwargs)
+        self._rollup_row = self.rollup_row
+
+    @property
+    def rollup_row(self):
+        return (self.animal_id, self.milking_time, self.quantity_ml)
+
+    def normalize(self):
+        """Sets quantity_ml from quantity and units; bulk paths must call it."""
+        self.quantity_ml = self.quantity * UNIT_MILLILITERS[self.units]
+
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        self.normalize()
+        super(Milking, self).save(*args, **kwargs)
+        if self.rollup_row != self._rollup_row or created:
+            if not created:
+                MilkingRollup.objects.apply([self._rollup_row], -1)
+            MilkingRollup.objects.apply([self.rollup_row])
+            self._rollup_row = self.rollup_row
+
+    def delete(self, *args, **kwargs):
+        super(Milking, self).delete(*args, **kwargs)
+        MilkingRollup.objects.apply([self._rollup_row], -1)
+
+PERIOD_CHOICES = ( ('d', 'day'), ('w', 'week'), ('l', 'lactation') )
+
+class MilkingRollup(models.Model):
+    """
+    Milking rollup model class.
+
+    Milk produced by an animal per day, week (starting Monday) or lactation
+    (starting at a litter), maintained incrementally from Milking saves.
+    """
+    animal = models.ForeignKey(Animal, related_name='milk_rollups')
+    period = models.CharField(_('Period'), choices=PERIOD_CHOICES, max_length=1)
+    start = models.DateField(_('Start'))
+    quantity_ml = models.FloatField(_('Quantity in mililiters'), default=0)
+    milkings = models.IntegerField(_('Milkings'), default=0)
+
+    objects = MilkingRollupManager()
+
+    class Meta:
+        verbose_name = _('Milking rollup')
+        verbose_name_plural = _('Milking rollups')
+        unique_together = (('animal', 'period', 'start'),)
+
+    def __unicode__(self):
+        return u'%s of milk by %s for the %s of %s' % (self.quantity_ml, self.animal_id, self.get_period_display(), self.start)
+
 class AnimalAttributeOption(AttributeOption):
 
     class Meta:
@@ -390,8 +607,7 @@ class Building(MarkupMixin, TitleSlugDescriptionModel, TimeStampedModel):
     def age(self):
         if not self._age:
             if self.built:
-                DELTA=datetime.now()
-                self._age = get_fancy_time(relativedelta(DELTA, self.built), True)
+                self._age = format_age((date.today() - self.built).days)
             else: self._age = "Unknown"
         return self._age
 
@@ -484,6 +700,34 @@ class Field(MarkupMixin, TitleSlugDescriptionModel, TimeStampedModel):
     def get_absolute_url(self):
         return ('fm-field-detail', None, {'slug': self.slug})
 
+class SearchEntry(models.Model):
+    """
+    Search entry model class.
+
+    Denormalized searchable text of an animal, product, building or field
+    with the values it is faceted by, kept current by farm.search.
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    content_object = generic.GenericForeignKey()
+    title = models.CharField(_('Title'), max_length=255)
+    url = models.CharField(_('URL'), blank=True, max_length=255)
+    text = models.TextField(_('Text'), blank=True)
+    genus = models.ForeignKey(Genus, blank=True, null=True, on_delete=models.SET_NULL)
+    breed = models.ForeignKey(Breed, blank=True, null=True, on_delete=models.SET_NULL)
+    sex = models.CharField(_('Sex'), blank=True, max_length=1)
+    farm = models.ForeignKey(Farm, blank=True, null=True, on_delete=models.SET_NULL)
+
+    objects = SearchEntryManager()
+
+    class Meta:
+        verbose_name=_('Search entry')
+        verbose_name_plural=_('Search entries')
+        unique_together = (('content_type', 'object_id'),)
+
+    def __unicode__(self):
+        return u'%s' % self.title
+
 class FieldAttributeOption(AttributeOption):
 
     class Meta:
@@ -500,3 +744,5 @@ class FieldAttribute(BaseAttribute):
 
     def __unicode__(self):
         return u'%s attribute of %s' %(self.option, self.field.title)
+
+from farm import signals
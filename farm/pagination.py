@@ -0,0 +1,45 @@
+"""
+Keyset (seek) pagination.
+
+A page is addressed by the pk of the last row of the previous page rather than
+by an OFFSET, so every page costs the same indexed range scan however deep
+into the table it is.
+"""
+from django.db.models import Q
+
+class KeysetPage(object):
+    def __init__(self, object_list, next_cursor, has_previous=False):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.has_previous = has_previous
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+def keyset_paginate(queryset, ordering, after=None, per_page=50):
+    """
+    Returns a KeysetPage of queryset ordered by (ordering, pk).
+
+    ordering: a non-null field name, prefixed with '-' for descending order
+    after: pk of the last row already shown, or None for the first page
+
+    Raises ValueError for a cursor that matches no row.
+    """
+    descending = ordering.startswith('-')
+    field = ordering.lstrip('-')
+    queryset = queryset.order_by(ordering, '-pk' if descending else 'pk')
+    if after:
+        values = queryset.model._default_manager.filter(pk=after).values_list(field, flat=True)[:1]
+        if not values:
+            raise ValueError('Unknown cursor %s' % after)
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(Q(**{'%s__%s' % (field, op): values[0]}) |
+                Q(**{field: values[0], 'pk__%s' % op: after}))
+
+    rows = list(queryset[:per_page + 1])
+    next_cursor = rows[per_page - 1].pk if len(rows) > per_page else None
+    return KeysetPage(rows[:per_page], next_cursor, bool(after))
@@ -0,0 +1,267 @@
+"""
+Pedigree math for the farm: inbreeding and kinship coefficients, and the
+layout of pedigree charts.
+
+Coefficients are computed with the tabular method of Meuwissen and Luo (1992)
+over a compact in-memory copy of the dam/sire graph, so a whole herd is
+loaded with one query and each coefficient only walks the ancestors of the
+animal concerned.
+"""
+from array import array
+from heapq import heappush, heappop
+
+from farm.utils import chunks, topological_order
+
+BATCH_SIZE = 500
+
+class PedigreeIndex(object):
+    """
+    Compact copy of the dam/sire graph.
+
+    Animals are numbered in topological order, dams and sires are kept in
+    integer arrays indexed by that number (-1 for an unknown parent), and
+    Wright's inbreeding coefficients in a parallel float array.
+    """
+    def __init__(self, rows):
+        """
+        rows: iterable of (id, dam_id, sire_id) or (id, dam_id, sire_id,
+        inbreeding) tuples. A known inbreeding value is trusted, any other
+        is computed. The rows must include every ancestor of every animal.
+        """
+        parents = {}
+        known = {}
+        for row in rows:
+            parents[row[0]] = (row[1], row[2])
+            if len(row) > 3 and row[3] is not None:
+                known[row[0]] = row[3]
+
+        self.ids = topological_order(parents)
+        self.index = dict((pk, i) for i, pk in enumerate(self.ids))
+        self.dams = array('l', [self.index.get(parents[pk][0], -1) for pk in self.ids])
+        self.sires = array('l', [self.index.get(parents[pk][1], -1) for pk in self.ids])
+        self.coefficients = array('d', [0.0]) * len(self.ids)
+        self.variances = array('d', [1.0]) * len(self.ids)
+
+        previous = None
+        for i, pk in enumerate(self.ids):
+            couple = (self.dams[i], self.sires[i])
+            if pk in known:
+                self.coefficients[i] = known[pk]
+            elif couple == previous:
+                # Full siblings are adjacent in topological order.
+                self.coefficients[i] = self.coefficients[i - 1]
+            else:
+                self.coefficients[i] = self._offspring(*couple)
+            self.variances[i] = self._variance(*couple)
+            previous = couple
+
+    @classmethod
+    def load(cls, queryset=None):
+        """
+        Builds the index for the whole herd, or for an ancestrally closed
+        queryset of animals, recomputing every coefficient.
+        """
+        if queryset is None:
+            from farm.models import Animal
+            queryset = Animal.objects.all()
+        return cls(queryset.values_list('pk', 'dam', 'sire').iterator())
+
+    def _variance(self, dam, sire):
+        variance = 1.0
+        if dam >= 0:
+            variance -= 0.25 * (1 + self.coefficients[dam])
+        if sire >= 0:
+            variance -= 0.25 * (1 + self.coefficients[sire])
+        return variance
+
+    def _offspring(self, dam, sire):
+        """Inbreeding coefficient of an offspring of the given positions."""
+        if dam < 0 and sire < 0:
+            return 0.0
+        total = self._variance(dam, sire)
+        shares = {}
+        heap = []
+        for parent in (dam, sire):
+            if parent >= 0:
+                if parent not in shares:
+                    shares[parent] = 0.0
+                    heappush(heap, -parent)
+                shares[parent] += 0.5
+
+        # Ancestors are visited youngest first, so every contribution to an
+        # ancestor's share is in before the ancestor itself is reached.
+        dams, sires, variances = self.dams, self.sires, self.variances
+        while heap:
+            j = -heappop(heap)
+            share = shares[j]
+            total += share * share * variances[j]
+            half = 0.5 * share
+            for parent in (dams[j], sires[j]):
+                if parent >= 0:
+                    if parent in shares:
+                        shares[parent] += half
+                    else:
+                        shares[parent] = half
+                        heappush(heap, -parent)
+        return total - 1.0
+
+    def inbreeding(self, pk):
+        return self.coefficients[self.index[pk]]
+
+    def offspring_inbreeding(self, dam_id, sire_id):
+        """Inbreeding coefficient expected for an offspring of dam and sire."""
+        return self._offspring(self.index.get(dam_id, -1), self.index.get(sire_id, -1))
+
+    def kinship(self, a, b):
+        """Coefficient of kinship between the animals with ids a and b."""
+        return self._offspring(self.index[a], self.index[b])
+
+    def kinships(self, pairs):
+        """Coefficients of kinship for a list of (id, id) pairs."""
+        seen = {}
+        results = []
+        for a, b in pairs:
+            key = (a, b) if a <= b else (b, a)
+            if key not in seen:
+                seen[key] = self.kinship(a, b)
+            results.append(seen[key])
+        return results
+
+    def ancestors(self, pk):
+        """Ids of every known ancestor of the animal with id pk."""
+        seen = set()
+        stack = [self.index[pk]]
+        while stack:
+            i = stack.pop()
+            for parent in (self.dams[i], self.sires[i]):
+                if parent >= 0 and parent not in seen:
+                    seen.add(parent)
+                    stack.append(parent)
+        return set(self.ids[i] for i in seen)
+
+    def add(self, pk, dam_id=None, sire_id=None):
+        """
+        Appends a newborn to the index and returns its inbreeding
+        coefficient, without recomputing the rest of the herd.
+        """
+        dam, sire = self.index.get(dam_id, -1), self.index.get(sire_id, -1)
+        coefficient = self._offspring(dam, sire)
+        self.index[pk] = len(self.ids)
+        self.ids.append(pk)
+        self.dams.append(dam)
+        self.sires.append(sire)
+        self.coefficients.append(coefficient)
+        self.variances.append(self._variance(dam, sire))
+        return coefficient
+
+def closed_index(animal_ids, recompute=()):
+    """
+    Builds a PedigreeIndex of the given animals and all their ancestors,
+    found through the ancestry closure. Stored coefficients are reused except
+    for the animals in recompute.
+    """
+    from farm.models import Animal, AnimalAncestry
+
+    closed = set(pk for pk in animal_ids if pk)
+    for batch in chunks(list(closed), BATCH_SIZE):
+        closed.update(AnimalAncestry.objects.filter(descendant__in=batch).values_list('ancestor', flat=True))
+
+    recompute = set(recompute)
+    rows = []
+    for batch in chunks(closed, BATCH_SIZE):
+        for pk, dam, sire, inbreeding in Animal.objects.filter(pk__in=batch).values_list(
+                'pk', 'dam', 'sire', 'inbreeding'):
+            rows.append((pk, dam, sire, None if pk in recompute else inbreeding))
+    return PedigreeIndex(rows)
+
+def offspring_inbreeding(dam_id, sire_id):
+    """Inbreeding coefficient of an offspring of the given dam and sire."""
+    if not (dam_id and sire_id):
+        return 0.0
+    return closed_index([dam_id, sire_id]).offspring_inbreeding(dam_id, sire_id)
+
+def kinships(pairs):
+    """
+    Batch kinship for candidate pairings: loads the pedigree of every animal
+    in pairs once and returns one coefficient per (id, id) pair.
+    """
+    pairs = list(pairs)
+    index = closed_index(set(pk for pair in pairs for pk in pair))
+    return index.kinships(pairs)
+
+def refresh_inbreeding(animal_ids=None):
+    """
+    Recomputes and stores the inbreeding coefficients of the given animals,
+    or of the whole herd, writing only the values that changed.
+    """
+    from farm.models import Animal
+
+    if animal_ids is None:
+        stored = dict(Animal.objects.values_list('pk', 'inbreeding').iterator())
+        index = PedigreeIndex.load()
+    else:
+        animal_ids = set(animal_ids)
+        if not animal_ids:
+            return
+        index = closed_index(animal_ids, recompute=animal_ids)
+        stored = {}
+        for batch in chunks(animal_ids, BATCH_SIZE):
+            stored.update(Animal.objects.filter(pk__in=batch).values_list('pk', 'inbreeding'))
+
+    # Most of a herd shares a handful of coefficients, so the changed rows
+    # are written with one UPDATE per coefficient and batch.
+    changed = {}
+    for pk, old in stored.iteritems():
+        new = index.inbreeding(pk)
+        if old is None or abs(new - old) > 1e-9:
+            changed.setdefault(new, []).append(pk)
+    for new, pks in changed.iteritems():
+        for batch in chunks(pks, BATCH_SIZE):
+            Animal.objects.filter(pk__in=batch).update(inbreeding=new)
+
+CHART_FIELDS = ('pk', 'name', 'slug', 'uuid', 'sex', 'dam', 'sire', 'birthday', 'breed_label', 'modified',
+        'primary_breed__slug', 'primary_breed__genus__slug')
+CHART_BOX = (160, 36)
+CHART_GAP = (40, 8)
+
+def chart_rows(animal, generations):
+    """
+    values() rows of the animal and its ancestors up to generations back,
+    the ancestors read with one query against the ancestry closure.
+    """
+    from farm.models import Animal
+    rows = [Animal.objects.filter(pk=animal.pk).values(*CHART_FIELDS)[0]]
+    rows.extend(Animal.objects.filter(descendant_links__descendant=animal,
+            descendant_links__depth__lte=generations).distinct().values(*CHART_FIELDS))
+    return rows
+
+def chart(rows, generations):
+    """
+    Layout of a pedigree chart from chart_rows(): a box per known animal,
+    the subject on the left and each generation back a column further
+    right with dams above sires, and the lines joining children to parents.
+    """
+    by_pk = dict((row['pk'], row) for row in rows)
+    width, height = CHART_BOX
+    gap_x, gap_y = CHART_GAP
+    total = (2 ** generations) * (height + gap_y)
+    boxes, lines = [], []
+    level = [(rows[0], 0)]
+    for depth in range(generations + 1):
+        slot = float(total) / 2 ** depth
+        x = depth * (width + gap_x)
+        parents = []
+        for row, index in level:
+            y = int(slot * (index + 0.5) - height / 2)
+            boxes.append({'animal': row, 'x': x, 'y': y, 'width': width, 'height': height, 'depth': depth})
+            if depth == generations:
+                continue
+            for offset, parent in enumerate((row['dam'], row['sire'])):
+                if parent in by_pk:
+                    parent_index = index * 2 + offset
+                    parent_y = int(float(total) / 2 ** (depth + 1) * (parent_index + 0.5))
+                    lines.append({'x1': x + width, 'y1': y + height / 2, 'xm': x + width + gap_x / 2,
+                            'x2': x + width + gap_x, 'y2': parent_y})
+                    parents.append((by_pk[parent], parent_index))
+        level = parents
+    return {'boxes': boxes, 'lines': lines, 'width': (generations + 1) * (width + gap_x) - gap_x, 'height': total}
@@ -0,0 +1,87 @@
+"""
+Mating planner: ranks the sires on the farm for a dam.
+
+Every candidate is scored in memory against a PedigreeIndex of the whole
+herd, loaded once per process with the stored inbreeding coefficients and
+reloaded only after farm.signals bumps the 'pedigree' namespace, when an
+animal's parents change, or when it lacks an animal being ranked, so
+ranking hundreds of sires costs a handful of queries.
+"""
+import threading
+
+from farm.caching import generation
+from farm.models import Animal
+from farm.pedigree import PedigreeIndex
+
+_lock = threading.Lock()
+_herd = {'generation': None, 'index': None}
+
+def herd_index(required=()):
+    """
+    The process's PedigreeIndex of the herd, reloaded when parents changed
+    or when it lacks one of the required animal pks, e.g. an animal added
+    since it was loaded.
+    """
+    current = generation('pedigree')
+    with _lock:
+        index = _herd['index']
+        if _herd['generation'] != current or index is None or any(pk not in index.index for pk in required):
+            _herd['index'] = PedigreeIndex(Animal.objects.values_list('pk', 'dam', 'sire', 'inbreeding').iterator())
+            _herd['generation'] = current
+        return _herd['index']
+
+class Pairing(object):
+    """
+    A candidate sire for a dam: the expected inbreeding of their offspring,
+    its breed composition as (breed, percentage) pairs, largest first, and
+    the number of ancestors the dam and sire share.
+    """
+    def __init__(self, sire, inbreeding, composition, shared_ancestors, target):
+        self.sire = sire
+        self.inbreeding = inbreeding
+        self.composition = composition
+        self.shared_ancestors = shared_ancestors
+        self.target_percentage = dict(composition).get(target, 0)
+
+    def __repr__(self):
+        return '<Pairing: %s, F=%.4f, %s shared>' % (self.sire, self.inbreeding, self.shared_ancestors)
+
+def _compositions(animals):
+    """Breed title to percentage per animal, from (pk, primary breed title) pairs."""
+    secondary = Animal.objects._secondary_breeds([pk for pk, title in animals])
+    compositions = {}
+    for pk, title in animals:
+        parts = dict(secondary.get(pk, []))
+        parts[title] = parts.get(title, 0) + 100 - sum(percentage for t, percentage in secondary.get(pk, []))
+        compositions[pk] = parts
+    return compositions
+
+def rank_sires(dam, breed=None, limit=None):
+    """
+    Ranks the living males on the farm of the dam's genus as mates for the
+    dam: lowest offspring inbreeding first, then the largest share of breed
+    (a Breed, by default the dam's primary breed) in the offspring, then the
+    fewest shared ancestors. Returns a list of Pairing.
+    """
+    breed = breed or dam.primary_breed
+    sires = list(Animal.onthefarm_objects.filter(sex='M', primary_breed__genus=dam.primary_breed.genus_id)
+            .exclude(pk=dam.pk).select_related('primary_breed__genus', 'dam'))
+    if not sires:
+        return []
+    index = herd_index([dam.pk] + [sire.pk for sire in sires])
+    compositions = _compositions([(dam.pk, dam.primary_breed.title)] +
+            [(sire.pk, sire.primary_breed.title) for sire in sires])
+    dam_lineage = index.ancestors(dam.pk) | set([dam.pk])
+
+    pairings = []
+    for sire in sires:
+        offspring = {}
+        for parent in (dam.pk, sire.pk):
+            for title, percentage in compositions[parent].iteritems():
+                offspring[title] = offspring.get(title, 0) + percentage / 2.0
+        composition = sorted(offspring.iteritems(), key=lambda part: (-part[1], part[0]))
+        shared = len(dam_lineage & (index.ancestors(sire.pk) | set([sire.pk])))
+        pairings.append(Pairing(sire, index.offspring_inbreeding(dam.pk, sire.pk), composition, shared, breed.title))
+
+    pairings.sort(key=lambda p: (round(p.inbreeding, 9), -p.target_percentage, p.shared_ancestors, p.sire.pk))
+    return pairings[:limit] if limit else pairings
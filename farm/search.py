@@ -0,0 +1,88 @@
+"""
+Search index of the farm's animals, products, buildings and fields.
+
+Every indexed object has one SearchEntry holding its title, URL, searchable
+text (names, uuid, breeds, registration ids, description and notes) and the
+genus, breed, sex and farm it is faceted by. farm.signals keeps the entries
+current; rebuild() recreates them all, e.g. after a bulk import.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import NoReverseMatch
+from django.utils.html import strip_tags
+
+from farm.models import Animal, AnimalRegistration, Building, Field, Note, Product, SearchEntry
+from farm.utils import chunks
+
+BATCH_SIZE = 500
+
+INDEXED = (Animal, Product, Building, Field)
+
+def _join(*parts):
+    return u' '.join(unicode(part) for part in parts if part)
+
+def _querysets():
+    return {
+        Animal: Animal.objects.select_related('primary_breed__genus', 'dam'),
+        Product: Product.objects.select_related('type'),
+        Building: Building.objects.all(),
+        Field: Field.objects.select_related('type'),
+    }
+
+def _url(obj):
+    try:
+        return obj.get_absolute_url()
+    except NoReverseMatch:
+        # The project does not route the farm's pages.
+        return ''
+
+def _entry(obj, content_type, notes, registrations):
+    entry = SearchEntry(content_type=content_type, object_id=obj.pk, title=unicode(obj)[:255], url=_url(obj))
+    if isinstance(obj, Animal):
+        breed = obj.primary_breed
+        entry.title = obj.display_name[:255]
+        entry.genus_id, entry.breed_id, entry.sex, entry.farm_id = breed.genus_id, breed.pk, obj.sex, obj.owner_farm_id
+        entry.text = _join(obj.name, obj.uuid, obj.breed_label, obj.breed_composition, breed.genus.title,
+                obj.alt_owner, obj.alt_breeder, strip_tags(obj.rendered_description or ''), *registrations)
+    elif isinstance(obj, Product):
+        entry.text = _join(obj.title, obj.type.title, obj.description)
+    else:
+        entry.farm_id = obj.farm_id
+        entry.text = _join(obj.title, getattr(obj, 'type', None) and obj.type.title,
+                strip_tags(obj.rendered_description or ''))
+    entry.text = _join(entry.text, *notes)
+    return entry
+
+def index(model, pks):
+    """Recreates the entries of the given objects, dropping those of deleted ones."""
+    content_type = ContentType.objects.get_for_model(model)
+    for batch in chunks(set(pks), BATCH_SIZE):
+        objects = list(_querysets()[model].filter(pk__in=batch))
+        notes, registrations = {}, {}
+        for object_id, content in Note.objects.filter(content_type=content_type, object_id__in=batch).values_list(
+                'object_id', 'content'):
+            notes.setdefault(object_id, []).append(strip_tags(content or ''))
+        if model is Animal:
+            for animal_id, reg_id in AnimalRegistration.objects.filter(animal__in=batch).values_list('animal', 'reg_id'):
+                registrations.setdefault(animal_id, []).append(reg_id)
+        SearchEntry.objects.filter(content_type=content_type, object_id__in=batch).delete()
+        SearchEntry.objects.bulk_create([_entry(obj, content_type, notes.get(obj.pk, ()), registrations.get(obj.pk, ()))
+                for obj in objects])
+
+def unindex(model, pks):
+    content_type = ContentType.objects.get_for_model(model)
+    for batch in chunks(set(pks), BATCH_SIZE):
+        SearchEntry.objects.filter(content_type=content_type, object_id__in=batch).delete()
+
+def rebuild():
+    """Recreates the whole index."""
+    SearchEntry.objects.all().delete()
+    for model in INDEXED:
+        index(model, model.objects.values_list('pk', flat=True).iterator())
+
+def search(query, **filters):
+    """
+    Entries matching query, narrowed by genus, breed, sex and farm filters,
+    and their facet counts.
+    """
+    entries = SearchEntry.objects.matching(query).filter(**dict((k, v) for k, v in filters.iteritems() if v))
+    return entries.order_by('title'), entries.facets()
@@ -0,0 +1,123 @@
+"""
+Signal handlers keeping the cached farm data current.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_save, post_delete
+
+from farm import search
+from farm.caching import bump, object_namespace
+from farm.models import Animal, AnimalRegistration, Breed, Building, BuildingSpace, Genus, Farm, Field, Litter, Milking, Note, Product, SecondaryBreed
+
+def invalidate_tags(sender, **kwargs):
+    bump('tags')
+
+for model in (Animal, Breed, Genus, Farm):
+    post_save.connect(invalidate_tags, sender=model, dispatch_uid='farm-tags-save-%s' % model.__name__)
+    post_delete.connect(invalidate_tags, sender=model, dispatch_uid='farm-tags-delete-%s' % model.__name__)
+
+def invalidate_stats(sender, **kwargs):
+    bump('stats')
+
+for model in (Animal, Breed, Genus, Farm, Litter, Milking):
+    post_save.connect(invalidate_stats, sender=model, dispatch_uid='farm-stats-save-%s' % model.__name__)
+    post_delete.connect(invalidate_stats, sender=model, dispatch_uid='farm-stats-delete-%s' % model.__name__)
+
+def refresh_secondary_breeds(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(Animal).id:
+        Animal.objects.refresh_breeds([instance.object_id])
+        search.index(Animal, [instance.object_id])
+
+def refresh_breed_labels(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    breeds = Breed.objects.filter(genus=instance) if sender is Genus else [instance]
+    animal_type = ContentType.objects.get_for_model(Animal)
+    ids = set(Animal.objects.filter(primary_breed__in=breeds).values_list('pk', flat=True))
+    ids.update(SecondaryBreed.objects.filter(content_type=animal_type, breed__in=breeds).values_list('object_id', flat=True))
+    Animal.objects.refresh_breeds(ids)
+    search.index(Animal, ids)
+
+post_save.connect(refresh_secondary_breeds, sender=SecondaryBreed, dispatch_uid='farm-secondary-breed-save')
+post_delete.connect(refresh_secondary_breeds, sender=SecondaryBreed, dispatch_uid='farm-secondary-breed-delete')
+post_save.connect(refresh_breed_labels, sender=Breed, dispatch_uid='farm-breed-labels-breed')
+post_save.connect(refresh_breed_labels, sender=Genus, dispatch_uid='farm-breed-labels-genus')
+
+def index_object(sender, instance, **kwargs):
+    search.index(sender, [instance.pk])
+
+def unindex_object(sender, instance, **kwargs):
+    search.unindex(sender, [instance.pk])
+
+def index_registered_animal(sender, instance, **kwargs):
+    search.index(Animal, [instance.animal_id])
+
+def index_noted_object(sender, instance, **kwargs):
+    model = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+    if model in search.INDEXED:
+        search.index(model, [instance.object_id])
+
+for model in search.INDEXED:
+    post_save.connect(index_object, sender=model, dispatch_uid='farm-search-save-%s' % model.__name__)
+    post_delete.connect(unindex_object, sender=model, dispatch_uid='farm-search-delete-%s' % model.__name__)
+post_save.connect(index_registered_animal, sender=AnimalRegistration, dispatch_uid='farm-search-registration-save')
+post_delete.connect(index_registered_animal, sender=AnimalRegistration, dispatch_uid='farm-search-registration-delete')
+post_save.connect(index_noted_object, sender=Note, dispatch_uid='farm-search-note-save')
+post_delete.connect(index_noted_object, sender=Note, dispatch_uid='farm-search-note-delete')
+
+def touch(model, *pks):
+    """Invalidates the cached pages and fragments of the given objects."""
+    bump(*[object_namespace(model, pk) for pk in set(pks) if pk])
+
+def touch_related_animals(animal_ids):
+    """Invalidates animals along with their parents and breeds."""
+    rows = list(Animal.objects.filter(pk__in=animal_ids).values_list('pk', 'dam', 'sire', 'primary_breed'))
+    touch(Animal, *[pk for row in rows for pk in row[:3]])
+    touch(Breed, *[row[3] for row in rows])
+
+def touch_animal(sender, instance, **kwargs):
+    # The parents and breed before the save are still in _parents and
+    # _primary_breed_id, their pages list the animal too.
+    touch(Animal, instance.pk, instance.dam_id, instance.sire_id, *instance._parents)
+    touch(Breed, instance.primary_breed_id, instance._primary_breed_id)
+
+def touch_milked_animal(sender, instance, **kwargs):
+    touch(Animal, instance.animal_id)
+
+def touch_registered_animal(sender, instance, **kwargs):
+    touch_related_animals([instance.animal_id])
+
+def touch_noted_object(sender, instance, **kwargs):
+    model = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+    if model is Animal:
+        touch_related_animals([instance.object_id])
+    elif model in (Product, Building, Field):
+        touch(model, instance.object_id)
+
+def touch_space_building(sender, instance, **kwargs):
+    touch(Building, instance.building_id)
+
+def touch_details(sender, **kwargs):
+    bump('detail')
+
+for signal in (post_save, post_delete):
+    name = 'save' if signal is post_save else 'delete'
+    signal.connect(touch_animal, sender=Animal, dispatch_uid='farm-touch-animal-%s' % name)
+    signal.connect(touch_milked_animal, sender=Milking, dispatch_uid='farm-touch-milking-%s' % name)
+    signal.connect(touch_registered_animal, sender=AnimalRegistration, dispatch_uid='farm-touch-registration-%s' % name)
+    signal.connect(touch_noted_object, sender=Note, dispatch_uid='farm-touch-note-%s' % name)
+    signal.connect(touch_space_building, sender=BuildingSpace, dispatch_uid='farm-touch-space-%s' % name)
+    for model in (Farm, Genus, Breed):
+        signal.connect(touch_details, sender=model, dispatch_uid='farm-touch-details-%s-%s' % (model.__name__, name))
+
+def invalidate_pedigree(sender, instance, created=False, **kwargs):
+    # Runs before Animal.save() records the new parents in _parents. New
+    # founders change no pedigree, farm.planner loads them when needed.
+    parents = (instance.dam_id, instance.sire_id)
+    if (created and any(parents)) or parents != instance._parents:
+        bump('pedigree')
+
+def drop_from_pedigree(sender, **kwargs):
+    bump('pedigree')
+
+post_save.connect(invalidate_pedigree, sender=Animal, dispatch_uid='farm-pedigree-save')
+post_delete.connect(drop_from_pedigree, sender=Animal, dispatch_uid='farm-pedigree-delete')
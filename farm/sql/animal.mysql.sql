@@ -0,0 +1,3 @@
+CREATE INDEX farm_animal_on_farm_dam_id ON farm_animal (on_farm, dam_id);
+CREATE INDEX farm_animal_on_farm_sire_id ON farm_animal (on_farm, sire_id);
+CREATE INDEX farm_animal_on_farm_primary_breed_id ON farm_animal (on_farm, primary_breed_id);
@@ -0,0 +1,3 @@
+CREATE INDEX farm_animal_on_farm_dam_id ON farm_animal (dam_id) WHERE on_farm = 1;
+CREATE INDEX farm_animal_on_farm_sire_id ON farm_animal (sire_id) WHERE on_farm = 1;
+CREATE INDEX farm_animal_on_farm_primary_breed_id ON farm_animal (primary_breed_id) WHERE on_farm = 1;
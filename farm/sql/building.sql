@@ -0,0 +1 @@
+CREATE INDEX farm_building_title_id ON farm_building (title, id);
@@ -0,0 +1 @@
+CREATE INDEX farm_field_title_id ON farm_field (title, id);
@@ -0,0 +1 @@
+CREATE INDEX farm_genus_title_id ON farm_genus (title, id);
@@ -0,0 +1 @@
+CREATE INDEX farm_milking_animal_id_milking_time ON farm_milking (animal_id, milking_time);
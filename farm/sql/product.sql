@@ -0,0 +1 @@
+CREATE INDEX farm_product_title_id ON farm_product (title, id);
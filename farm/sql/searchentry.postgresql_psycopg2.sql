@@ -0,0 +1 @@
+CREATE INDEX farm_searchentry_fts ON farm_searchentry USING gin (to_tsvector('simple', title || ' ' || text));
@@ -0,0 +1,5 @@
+-- Full-text index of the search entries, kept in step by triggers. Each trigger stays on one line so the custom SQL loader does not split its body.
+CREATE VIRTUAL TABLE farm_searchentry_fts USING fts5(title, text, content='farm_searchentry', content_rowid='id');
+CREATE TRIGGER farm_searchentry_fts_insert AFTER INSERT ON farm_searchentry BEGIN INSERT INTO farm_searchentry_fts (rowid, title, text) VALUES (new.id, new.title, new.text); END;
+CREATE TRIGGER farm_searchentry_fts_delete AFTER DELETE ON farm_searchentry BEGIN INSERT INTO farm_searchentry_fts (farm_searchentry_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text); END;
+CREATE TRIGGER farm_searchentry_fts_update AFTER UPDATE ON farm_searchentry BEGIN INSERT INTO farm_searchentry_fts (farm_searchentry_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text); INSERT INTO farm_searchentry_fts (rowid, title, text) VALUES (new.id, new.title, new.text); END;
@@ -0,0 +1,69 @@
+"""
+Herd-wide statistics for dashboards.
+
+Every figure is one grouped aggregate query, cached in the 'stats' namespace
+which farm.signals bumps whenever animals, litters or milkings change.
+"""
+from django.db import connection
+from django.db.models import Avg, Count, Sum
+
+from farm.caching import cached
+from farm.models import Animal, Litter, MilkingRollup
+
+GENUS = 'primary_breed__genus__title'
+BREED = 'primary_breed__title'
+
+def head_count():
+    """Animals on the farm per genus, breed and sex."""
+    return cached('stats', ['head_count'], lambda: [{'genus': row[GENUS], 'breed': row[BREED], 'sex': row['sex'],
+            'count': row['count']} for row in Animal.onthefarm_objects.values(GENUS, BREED, 'sex')
+            .annotate(count=Count('pk')).order_by(GENUS, BREED, 'sex')])
+
+def _month(value):
+    if isinstance(value, basestring):
+        return value[:7]
+    return value.strftime('%Y-%m')
+
+def _per_month(field):
+    """Animals per genus and month of the given date field."""
+    column = '%s.%s' % (connection.ops.quote_name(Animal._meta.db_table), connection.ops.quote_name(field))
+    rows = (Animal.objects.filter(**{'%s__isnull' % field: False})
+            .extra(select={'month': connection.ops.date_trunc_sql('month', column)})
+            .values('month', GENUS).annotate(count=Count('pk')).order_by('month', GENUS))
+    return [{'month': _month(row['month']), 'genus': row[GENUS], 'count': row['count']} for row in rows]
+
+def births_per_month():
+    return cached('stats', ['births'], lambda: _per_month('birthday'))
+
+def deaths_per_month():
+    return cached('stats', ['deaths'], lambda: _per_month('deathday'))
+
+def litter_sizes():
+    """Number of litters and average size and survivors per genus."""
+    genus = 'dam__primary_breed__genus__title'
+    return cached('stats', ['litters'], lambda: [{'genus': row[genus], 'litters': row['litters'],
+            'average_size': row['average_size'], 'average_born_alive': row['average_born_alive']}
+            for row in Litter.objects.values(genus).annotate(litters=Count('pk'), average_size=Avg('size'),
+                average_born_alive=Avg('born_alive')).order_by(genus)])
+
+def milk_per_doe():
+    """Milk in mililiters per milked doe and per lactation, per genus."""
+    genus = 'animal__primary_breed__genus__title'
+    def compute():
+        rows = (MilkingRollup.objects.filter(period='l').values(genus)
+                .annotate(total=Sum('quantity_ml'), does=Count('animal', distinct=True), lactations=Count('pk'))
+                .order_by(genus))
+        return [{'genus': row[genus], 'total_ml': row['total'], 'does': row['does'],
+                'per_doe_ml': row['total'] / row['does'], 'per_lactation_ml': row['total'] / row['lactations']}
+                for row in rows if row['does']]
+    return cached('stats', ['milk'], compute)
+
+def summary():
+    """Every statistic, as used by the stats view."""
+    return {
+        'head_count': head_count(),
+        'births': births_per_month(),
+        'deaths': deaths_per_month(),
+        'litters': litter_sizes(),
+        'milk': milk_per_doe(),
+    }
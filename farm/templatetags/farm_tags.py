@@ -1,11 +1,10 @@
 from django import template
 from django.db.models import Q
-from django.core.cache import cache
 from django.core.urlresolvers import resolve, reverse, Resolver404
 from farm.models import Genus, Breed, Animal
-from django.core.cache import cache
+from farm.caching import cached, generation, object_namespace
+from farm.instrumentation import timed
 from datetime import datetime
-from django import template
 
 register = template.Library()
 
@@ -16,9 +15,9 @@ class GetBreedsNode(template.Node):
     def __init__(self, varname):
         self.varname = varname
 
+    @timed('get_breeds')
     def render(self, context):
-        breeds = Breed.objects.all()
-        context[self.varname] = breeds
+        context[self.varname] = cached('tags', ['breeds'], lambda: list(Breed.objects.select_related('genus')))
         return ''
 
 def get_breeds(parser, token):
@@ -46,25 +45,23 @@ class GetGenusNode(template.Node):
         self.ex_obj = ex_obj
         self.all = all
 
+    @timed('get_genuses')
     def render(self, context):
         ex_obj = context.get(self.ex_obj, None)
-        cache_key = 'genuses'
-        genuses = cache.get(cache_key)
-        if genuses is None:
-            if all:
-                genuses = Genus.objects.all()
-            else:
-                genus_ids=Animal.onthefarm_objects.values('primary_breed__genus').distinct()
-                ids=[]
-                for g in genus_ids:
-                    ids.append(g['primary_breed__genus'])
-                try:
-                    genuses=Genus.objects.filter(id__in=ids).exclude(id=ex_obj.id)
-                except:
-                    genuses=Genus.objects.filter(id__in=ids)
-            context[self.varname] = genuses
+        ex_id = getattr(ex_obj, 'id', None)
+        context[self.varname] = cached('tags', ['genuses', bool(self.all), ex_id], lambda: self.get_genuses(ex_id))
         return ''
 
+    def get_genuses(self, ex_id):
+        if self.all:
+            genuses = Genus.objects.all()
+        else:
+            ids = Animal.onthefarm_objects.values_list('primary_breed__genus', flat=True).distinct()
+            genuses = Genus.objects.filter(id__in=ids)
+        if ex_id is not None:
+            genuses = genuses.exclude(id=ex_id)
+        return list(genuses)
+
 def get_genuses(parser, token):
     """
     Retrieves a list of genus with animals on the farm in them and places it into the context
@@ -91,7 +88,7 @@ def get_genuses(parser, token):
 
     return GetGenusNode(all=all, ex_obj=ex_obj, varname=varname)
 
-class GetNamedAnmialsNode(template.Node):
+class GetNamedAnimalsNode(template.Node):
     """
     Retrieves a list of animals on the farm with names and places it into the
     context.
@@ -99,12 +96,10 @@ class GetNamedAnmialsNode(template.Node):
     def __init__(self, varname):
         self.varname = varname
 
+    @timed('get_named_animals')
     def render(self, context):
-        cache_key = 'named_animals'
-        animals = cache.get(cache_key)
-        if animals is None:
-            animals=Animal.onthefarm_objects.filter(name__isnull=False)
-            context[self.varname] = animals
+        context[self.varname] = cached('tags', ['named_animals'],
+                lambda: list(Animal.onthefarm_objects.for_display().filter(name__isnull=False)))
         return ''
 
 def get_named_animals(parser, token):
@@ -136,6 +131,8 @@ def child_table_for(obj, switch=''):
         children = obj.sire_of()
     else:
         children = obj.progeny()
+    children = cached(object_namespace(Animal, obj.pk), ['children', switch, generation('detail')],
+            lambda: list(children.for_display()))
 
     if len(children) == 0:
         # go no further
@@ -0,0 +1,12 @@
+"""
+URLs of the benchmark suite: the farm's pages and the admin.
+"""
+from django.conf.urls.defaults import *
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = patterns('',
+    url(r'^admin/', include(admin.site.urls)),
+    url(r'^', include('farm.urls')),
+)
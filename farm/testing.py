@@ -0,0 +1,116 @@
+"""
+Synthetic herds and measuring helpers for the farm test and benchmark suite.
+"""
+import time
+from datetime import date, datetime, timedelta
+
+from django.db import connection
+
+from farm.models import Farm, Genus, Breed, Animal, Milking, ProductType, Product, Building, BuildingSpace, FieldType, Field
+
+def make_farm(title='Home', active=True, **kwargs):
+    """
+    Creates a farm with its coordinates filled in, so saving it does not
+    look them up on the network.
+    """
+    kwargs.setdefault('lat_long', '0, 0')
+    return Farm.objects.create(title=title, active=active, **kwargs)
+
+def make_herd(farms=2, breeds=2, generations=3, does=4, kids=2, milkings=0):
+    """
+    Creates a herd through the models' save(), so every maintained field is
+    filled in as it would be in production.
+
+    Each breed starts from ``does`` founder does and one buck. Every doe of a
+    generation has a litter of ``kids``; the doelings become the next
+    generation's does and one buckling its buck. Every doe gets ``milkings``
+    daily milkings after kidding. One product, building and field are added
+    so every page of the site has something to show.
+
+    Returns a dict of the created farms, breeds, does, bucks and animals.
+    """
+    herd = {'farms': [], 'breeds': [], 'does': [], 'bucks': [], 'animals': [], 'milkings': milkings}
+    for i in range(farms):
+        herd['farms'].append(make_farm('Farm %s' % i, active=(i == 0)))
+    genus = Genus.objects.create(title='Goat')
+    start = date(2000, 3, 1)
+
+    for b in range(breeds):
+        breed = Breed.objects.create(title='Breed %s' % b, genus=genus)
+        herd['breeds'].append(breed)
+        generation = [_animal(herd, breed, 'F', name='Founder %s-%s' % (b, d)) for d in range(does)]
+        buck = _animal(herd, breed, 'M', name='Buck %s' % b)
+        for g in range(generations):
+            birthday = start + timedelta(days=365 * (g + 1))
+            kids_born = []
+            for doe in generation:
+                kids_born.extend(add_litter(herd, doe, buck, birthday, kids))
+            doelings = [a for a in kids_born if a.sex == 'F']
+            bucklings = [a for a in kids_born if a.sex == 'M']
+            generation = doelings[:does] or generation
+            buck = bucklings[0] if bucklings else buck
+
+    product_type = ProductType.objects.create(title='Cheese')
+    herd['product'] = Product.objects.create(title='Chevre', type=product_type)
+    herd['building'] = Building.objects.create(title='Barn', farm=herd['farms'][0])
+    herd['space'] = BuildingSpace.objects.create(title='Loft', building=herd['building'])
+    herd['field'] = Field.objects.create(title='Pasture', farm=herd['farms'][0],
+            type=FieldType.objects.create(title='Grazing'))
+    return herd
+
+def _animal(herd, breed, sex, **kwargs):
+    animal = Animal.objects.create(primary_breed=breed, sex=sex, owner_farm=herd['farms'][0], **kwargs)
+    herd['animals'].append(animal)
+    (herd['does'] if sex == 'F' else herd['bucks']).append(animal)
+    return animal
+
+def add_litter(herd, doe, buck, birthday, kids):
+    """Adds a litter of kids, alternating sexes, and milkings of the doe."""
+    litter = [_animal(herd, doe.primary_breed, 'MF'[k % 2], name='Kid %s-%s-%s' % (doe.pk, birthday, k),
+            dam=doe, sire=buck, birthday=birthday) for k in range(kids)]
+    for day in range(herd['milkings']):
+        Milking.objects.create(animal=doe, quantity=2, units='l',
+                milking_time=datetime.combine(birthday + timedelta(days=day + 1), datetime.min.time()))
+    return litter
+
+def grow_herd(herd, litters=1, kids=2):
+    """Gives every doe of the herd more litters, the year after its last one."""
+    for doe in list(herd['does']):
+        births = doe.birthed_progeny().order_by('-birthday').values_list('birthday', 'sire')[:1]
+        if not births:
+            continue
+        birthday, sire = births[0]
+        for i in range(litters):
+            add_litter(herd, doe, Animal.objects.get(pk=sire), birthday + timedelta(days=365 * (i + 1)), kids)
+
+class Measurement(object):
+    def __init__(self, queries, seconds):
+        self.queries = queries
+        self.seconds = seconds
+
+    @property
+    def duplicates(self):
+        seen = set()
+        duplicates = 0
+        for query in self.queries:
+            if query['sql'] in seen:
+                duplicates += 1
+            seen.add(query['sql'])
+        return duplicates
+
+    def __repr__(self):
+        return '<Measurement: %s queries, %s duplicated, %.1f ms>' % (len(self.queries), self.duplicates,
+                self.seconds * 1000)
+
+def measure(func, *args, **kwargs):
+    """Calls func, returning the queries it ran and its wall time."""
+    debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    first = len(connection.queries)
+    started = time.time()
+    try:
+        func(*args, **kwargs)
+    finally:
+        seconds = time.time() - started
+        connection.use_debug_cursor = debug_cursor
+    return Measurement(connection.queries[first:], seconds)
@@ -21,3 +21,610 @@ Another way to test that 1 + 1 is equal to 2.
 True
 """}
 
+
+class AncestryTest(TestCase):
+    def setUp(self):
+        from farm.models import Genus, Breed, Animal
+        genus = Genus.objects.create(title='Goat')
+        self.breed = Breed.objects.create(title='Nubian', genus=genus)
+        self.grandam = Animal.objects.create(name='Grandam', sex='F', primary_breed=self.breed)
+        self.dam = Animal.objects.create(name='Dam', sex='F', primary_breed=self.breed, dam=self.grandam)
+        self.sire = Animal.objects.create(name='Sire', sex='M', primary_breed=self.breed)
+        self.kid = Animal.objects.create(name='Kid', sex='F', primary_breed=self.breed, dam=self.dam, sire=self.sire)
+
+    def test_ancestors(self):
+        self.assertEqual(set(self.kid.ancestors()), set([self.dam, self.sire, self.grandam]))
+        self.assertEqual(set(self.kid.ancestors(depth=1)), set([self.dam, self.sire]))
+        self.assertEqual(set(self.grandam.descendants()), set([self.dam, self.kid]))
+
+    def test_reparenting_updates_descendants(self):
+        self.dam.dam = None
+        self.dam.save()
+        self.assertEqual(set(self.kid.ancestors()), set([self.dam, self.sire]))
+        self.assertEqual(list(self.grandam.descendants()), [])
+
+    def test_save_refuses_cycles(self):
+        from django.core.exceptions import ValidationError
+        from farm.models import Animal
+        self.grandam.dam = self.kid
+        self.assertRaises(ValidationError, self.grandam.save)
+        self.assertEqual(Animal.objects.get(pk=self.grandam.pk).dam, None)
+        self.assertEqual(set(self.kid.ancestors()), set([self.dam, self.sire, self.grandam]))
+
+class PedigreeIndexTest(TestCase):
+    def setUp(self):
+        from farm.pedigree import PedigreeIndex
+        # 5 is a full-sib mating, 6 a parent-offspring one, 7 their offspring.
+        self.index = PedigreeIndex([(1, None, None), (2, None, None), (3, 1, 2),
+            (4, 1, 2), (5, 3, 4), (6, 3, 2), (7, 5, 6)])
+
+    def test_inbreeding(self):
+        self.assertEqual([self.index.inbreeding(pk) for pk in range(1, 8)],
+                [0.0, 0.0, 0.0, 0.0, 0.25, 0.25, 0.3125])
+
+    def test_kinship(self):
+        self.assertEqual(self.index.kinships([(3, 4), (1, 1), (1, 2)]), [0.25, 0.5, 0.0])
+
+    def test_add(self):
+        self.assertEqual(self.index.add(8, 5, 5), 0.625)
+        self.assertEqual(self.index.inbreeding(8), 0.625)
+
+class PedigreeChartTest(TestCase):
+    def test_chart_follows_parents(self):
+        from farm.models import Genus, Breed, Animal
+        from farm.pedigree import chart, chart_rows
+        breed = Breed.objects.create(title='Nubian', genus=Genus.objects.create(title='Goat'))
+        granddam = Animal.objects.create(name='Granddam', sex='F', primary_breed=breed)
+        dam = Animal.objects.create(name='Dam', sex='F', primary_breed=breed, dam=granddam)
+        sire = Animal.objects.create(name='Sire', sex='M', primary_breed=breed)
+        kid = Animal.objects.create(name='Kid', sex='F', primary_breed=breed, dam=dam, sire=sire)
+
+        rows = chart_rows(kid, 1)
+        self.assertEqual(sorted(row['name'] for row in rows), ['Dam', 'Kid', 'Sire'])
+        layout = chart(chart_rows(kid, 2), 2)
+        self.assertEqual([(b['animal']['name'], b['depth']) for b in layout['boxes']],
+                [('Kid', 0), ('Dam', 1), ('Sire', 1), ('Granddam', 2)])
+        self.assertEqual(len(layout['lines']), 3)
+
+    def test_chart_follows_secondary_breeds(self):
+        from django.core.cache import cache
+        from django.test.client import RequestFactory
+        from farm.models import Genus, Breed, Animal, SecondaryBreed
+        from farm.views import animal_pedigree
+        cache.clear()
+        genus = Genus.objects.create(title='Goat')
+        nubian = Breed.objects.create(title='Nubian', genus=genus)
+        alpine = Breed.objects.create(title='Alpine', genus=genus)
+        dam = Animal.objects.create(name='Dam', sex='F', primary_breed=nubian)
+        kid = Animal.objects.create(name='Kid', sex='F', primary_breed=nubian, dam=dam)
+        svg = lambda: animal_pedigree(RequestFactory().get('/', {'format': 'svg'}), genus.slug, nubian.slug, kid.slug).content
+        self.assertFalse('Mixed' in svg())
+        SecondaryBreed.objects.create(content_object=dam, breed=alpine, percentage=25)
+        self.assertTrue('Mixed Nubian Goat' in svg())
+
+class PlannerTest(TestCase):
+    def test_rank_sires(self):
+        from farm.models import Genus, Breed, Animal, SecondaryBreed
+        from farm.planner import rank_sires
+        from farm.testing import make_farm
+        farm = make_farm()
+        genus = Genus.objects.create(title='Goat')
+        nubian = Breed.objects.create(title='Nubian', genus=genus)
+        alpine = Breed.objects.create(title='Alpine', genus=genus)
+        create = lambda name, sex, breed, **kwargs: Animal.objects.create(name=name, sex=sex, primary_breed=breed,
+                owner_farm=farm, **kwargs)
+        grandsire = create('Grandsire', 'M', nubian)
+        doe = create('Doe', 'F', nubian, sire=grandsire)
+        half_brother = create('Half brother', 'M', nubian, sire=grandsire)
+        stranger = create('Stranger', 'M', alpine)
+        SecondaryBreed.objects.create(content_object=stranger, breed=nubian, percentage=50)
+        outsider = create('Outsider', 'M', alpine)
+
+        pairings = rank_sires(doe)
+        self.assertEqual([p.sire for p in pairings], [stranger, outsider, half_brother, grandsire])
+        self.assertEqual([p.inbreeding for p in pairings], [0.0, 0.0, 0.125, 0.25])
+        self.assertEqual(pairings[0].composition, [('Nubian', 75.0), ('Alpine', 25.0)])
+        self.assertEqual([p.shared_ancestors for p in pairings], [0, 0, 1, 1])
+
+    def test_index_follows_new_animals(self):
+        from farm.caching import generation
+        from farm.models import Genus, Breed, Animal
+        from farm.planner import herd_index, rank_sires
+        from farm.testing import make_farm
+        farm = make_farm()
+        breed = Breed.objects.create(title='Nubian', genus=Genus.objects.create(title='Goat'))
+        buck = Animal.objects.create(name='Buck', sex='M', primary_breed=breed, owner_farm=farm)
+        herd_index()
+        pedigree = generation('pedigree')
+        doe = Animal.objects.create(name='Doe', sex='F', primary_breed=breed, owner_farm=farm)
+        self.assertEqual(generation('pedigree'), pedigree)
+        self.assertEqual([(p.sire, p.inbreeding) for p in rank_sires(doe)], [(buck, 0.0)])
+        Animal.objects.create(name='Kid', sex='M', primary_breed=breed, owner_farm=farm, dam=doe, sire=buck)
+        self.assertNotEqual(generation('pedigree'), pedigree)
+        self.assertEqual([p.inbreeding for p in rank_sires(doe)], [0.0, 0.25])
+
+class GroupLittersTest(TestCase):
+    def test_contiguous_births(self):
+        from collections import namedtuple
+        from datetime import date, timedelta
+        from farm.utils import group_litters
+        Kid = namedtuple('Kid', 'birthday')
+        kids = [Kid(date(2011, 3, 1)), Kid(date(2011, 3, 2)), Kid(date(2011, 3, 3)), Kid(date(2012, 3, 1))]
+        litters = group_litters(kids, timedelta(days=1))
+        self.assertEqual(litters.keys(), [date(2011, 3, 1), date(2012, 3, 1)])
+        self.assertEqual(len(litters[date(2011, 3, 1)]), 3)
+
+class LitterTest(TestCase):
+    def setUp(self):
+        from farm.models import Genus, Breed, Animal
+        genus = Genus.objects.create(title='Goat')
+        self.breed = Breed.objects.create(title='Nubian', genus=genus)
+        self.dam = Animal.objects.create(name='Dam', sex='F', primary_breed=self.breed)
+
+    def kid(self, **kwargs):
+        from farm.models import Animal
+        return Animal.objects.create(sex='F', primary_breed=self.breed, dam=self.dam, **kwargs)
+
+    def test_births_share_a_litter(self):
+        from datetime import date
+        first = self.kid(birthday=date(2011, 3, 1))
+        second = self.kid(birthday=date(2011, 3, 2), deathday=date(2011, 3, 2))
+        later = self.kid(birthday=date(2012, 3, 1))
+        self.assertEqual(first.litter_id, second.litter_id)
+        self.assertNotEqual(first.litter_id, later.litter_id)
+        litter = self.dam.dam_litters.get(pk=first.litter_id)
+        self.assertEqual((litter.size, litter.born_alive, litter.lost), (2, 1, 1))
+        self.assertEqual(litter.end, date(2011, 3, 2))
+
+class SlugTest(TestCase):
+    def setUp(self):
+        from farm.models import Genus, Breed
+        genus = Genus.objects.create(title='Goat')
+        self.breed = Breed.objects.create(title='Nubian', genus=genus)
+
+    def test_assign_slugs(self):
+        from farm.models import Animal
+        Animal.objects.create(name='Daisy', sex='F', primary_breed=self.breed)
+        Animal.objects.create(name='Daisy Mae', sex='F', primary_breed=self.breed)
+        batch = [Animal(name='Daisy', sex='F', primary_breed=self.breed),
+                 Animal(name='Daisy', sex='F', primary_breed=self.breed),
+                 Animal(sex='F', primary_breed=self.breed)]
+        Animal.objects.assign_slugs(batch)
+        self.assertEqual([a.slug for a in batch[:2]], ['daisy-2', 'daisy-3'])
+        self.assertEqual(batch[2].slug, batch[2].uuid)
+
+class MilkingRollupTest(TestCase):
+    def test_rollups_follow_milkings(self):
+        from datetime import date, datetime
+        from farm.models import Genus, Breed, Animal, Milking
+        genus = Genus.objects.create(title='Goat')
+        breed = Breed.objects.create(title='Nubian', genus=genus)
+        doe = Animal.objects.create(name='Doe', sex='F', primary_breed=breed)
+        Milking.objects.create(animal=doe, milking_time=datetime(2011, 5, 2, 6), quantity=1, units='l')
+        evening = Milking.objects.create(animal=doe, milking_time=datetime(2011, 5, 2, 18), quantity=500, units='ml')
+        self.assertEqual(doe.milk_production(date(2011, 5, 1), date(2011, 5, 31)), [(date(2011, 5, 2), 1500.0)])
+        evening.delete()
+        self.assertEqual(doe.milk_production(date(2011, 5, 1), date(2011, 5, 31), bucket='w'), [(date(2011, 5, 2), 1000.0)])
+
+class BreedSummaryTest(TestCase):
+    def test_secondary_breeds_mark_animal_mixed(self):
+        from farm.models import Genus, Breed, Animal, SecondaryBreed
+        genus = Genus.objects.create(title='Goat')
+        nubian = Breed.objects.create(title='Nubian', genus=genus)
+        alpine = Breed.objects.create(title='Alpine', genus=genus)
+        doe = Animal.objects.create(name='Doe', sex='F', primary_breed=nubian)
+        self.assertEqual((doe.breed, doe.is_mixed), (u'Nubian Goat', False))
+        SecondaryBreed.objects.create(content_object=doe, breed=alpine, percentage=25)
+        doe = Animal.objects.get(pk=doe.pk)
+        self.assertEqual(doe.breed, u'Mixed Nubian Goat')
+        self.assertEqual(doe.breed_composition, u'Nubian 75%, Alpine 25%')
+        self.assertEqual(Animal.objects.filter(is_mixed=True).count(), 1)
+
+class AgeTest(TestCase):
+    def test_with_age_and_classes(self):
+        from datetime import date, timedelta
+        from farm.models import Genus, Breed, Animal
+        genus = Genus.objects.create(title='Goat', yearling_age=180, adult_age=365)
+        breed = Breed.objects.create(title='Nubian', genus=genus)
+        today = date.today()
+        kid = Animal.objects.create(name='Kid', sex='F', primary_breed=breed, birthday=today - timedelta(days=30))
+        adult = Animal.objects.create(name='Adult', sex='F', primary_breed=breed, birthday=today - timedelta(days=800))
+        self.assertEqual([a.age_days for a in Animal.objects.with_age().order_by('age_days')], [30, 800])
+        self.assertEqual(list(Animal.objects.of_age_class('kid')), [kid])
+        self.assertEqual(list(Animal.objects.of_age_class('adult')), [adult])
+        self.assertEqual(adult.age_class, 'adult')
+
+class InstrumentationTest(TestCase):
+    def test_request_record(self):
+        from django.db import connection
+        from farm import instrumentation
+        from farm.models import Genus
+        debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            record = instrumentation.start('view')
+            list(Genus.objects.all())
+            list(Genus.objects.all())
+            record.add_tag('tag', 0.5, 1)
+            summary = instrumentation.finish()
+        finally:
+            connection.use_debug_cursor = debug_cursor
+        self.assertEqual((summary['queries'], summary['duplicates']), (2, 1))
+        self.assertEqual(instrumentation.current(), None)
+        stats = instrumentation.stats()
+        self.assertEqual(stats['tag:tag']['queries'], 1)
+        self.assertTrue(stats['view']['count'] >= 1)
+
+    def test_flush_publishes_totals(self):
+        from django.core.cache import cache
+        from farm import instrumentation
+        cache.clear()
+        instrumentation._slot[0] = None
+        instrumentation.start('view')
+        instrumentation.finish()
+        instrumentation.flush()
+        self.assertEqual(instrumentation._slot[0], 1)
+        self.assertTrue(instrumentation.collected()['view']['count'] >= 1)
+
+class StatsTest(TestCase):
+    def test_aggregates_follow_changes(self):
+        from datetime import date, datetime
+        from farm import stats
+        from farm.models import Genus, Breed, Animal, Milking
+        from farm.testing import make_farm
+        farm = make_farm()
+        breed = Breed.objects.create(title='Nubian', genus=Genus.objects.create(title='Goat'))
+        doe = Animal.objects.create(name='Doe', sex='F', primary_breed=breed, owner_farm=farm)
+        Animal.objects.create(name='Kid', sex='M', primary_breed=breed, owner_farm=farm, dam=doe,
+                birthday=date(2012, 3, 4))
+        self.assertEqual([(r['sex'], r['count']) for r in stats.head_count()], [('F', 1), ('M', 1)])
+        self.assertEqual([(r['month'], r['count']) for r in stats.births_per_month()], [('2012-03', 1)])
+        self.assertEqual([r['average_size'] for r in stats.litter_sizes()], [1])
+
+        Animal.objects.create(name='Twin', sex='F', primary_breed=breed, owner_farm=farm, dam=doe,
+                birthday=date(2012, 3, 4))
+        Milking.objects.create(animal=doe, milking_time=datetime(2012, 3, 5, 8), quantity=2, units='l')
+        self.assertEqual([(r['sex'], r['count']) for r in stats.head_count()], [('F', 2), ('M', 1)])
+        self.assertEqual([r['average_size'] for r in stats.litter_sizes()], [2])
+        self.assertEqual([r['per_doe_ml'] for r in stats.milk_per_doe()], [2000])
+
+class SearchTest(TestCase):
+    def test_index_follows_changes(self):
+        from farm import search
+        from farm.models import Genus, Breed, Animal, AnimalRegistration, RegistrationBody
+        from farm.testing import make_farm
+        farm = make_farm()
+        breed = Breed.objects.create(title='Nubian', genus=Genus.objects.create(title='Goat'))
+        daisy = Animal.objects.create(name='Daisy', sex='F', primary_breed=breed, owner_farm=farm)
+        Animal.objects.create(name='Dandy', sex='M', primary_breed=breed, owner_farm=farm)
+        titles = lambda query, **filters: [e.title for e in search.search(query, **filters)[0]]
+
+        self.assertEqual(titles('dai'), ['Daisy'])
+        self.assertEqual(titles(daisy.uuid[:6]), ['Daisy'])
+        self.assertEqual(titles('nubian d'), ['Daisy', 'Dandy'])
+        self.assertEqual(titles('nubian', sex='M'), ['Dandy'])
+        self.assertEqual(search.search('goat')[1]['sex'], [('F', 'F', 1), ('M', 'M', 1)])
+
+        body = RegistrationBody.objects.create(title='ADGA', breed=breed)
+        AnimalRegistration.objects.create(animal=daisy, body=body, reg_id='N1234')
+        self.assertEqual(titles('n1234'), ['Daisy'])
+        daisy.delete()
+        self.assertEqual(titles('nubian'), ['Dandy'])
+
+class KeysetListViewTest(TestCase):
+    def test_pages_and_filters(self):
+        from django.test.client import RequestFactory
+        from farm.models import Product, ProductType
+        from farm.views import KeysetListView
+        cheese, soap = ProductType.objects.create(title='Cheese'), ProductType.objects.create(title='Soap')
+        for title, product_type in (('Feta', cheese), ('Chevre', cheese), ('Bar', soap), ('Chevre', soap)):
+            Product.objects.create(title=title, type=product_type)
+        view = KeysetListView.as_view(model=Product, per_page=2, filters={'type': 'type__slug'})
+        titles = lambda response: [(p.title, p.type.title) for p in response.context_data['object_list']]
+
+        first = view(RequestFactory().get('/products/'))
+        self.assertEqual(titles(first), [('Bar', 'Soap'), ('Chevre', 'Cheese')])
+        second = view(RequestFactory().get('/products/', {'after': first.context_data['page'].next_cursor}))
+        self.assertEqual(titles(second), [('Chevre', 'Soap'), ('Feta', 'Cheese')])
+        self.assertFalse(second.context_data['page'].has_next)
+        cheeses = view(RequestFactory().get('/products/', {'type': cheese.slug}))
+        self.assertEqual(titles(cheeses), [('Chevre', 'Cheese'), ('Feta', 'Cheese')])
+        self.assertEqual(first.context_data['product_list'], first.context_data['object_list'])
+        self.assertTrue(first.context_data['is_paginated'])
+        self.assertEqual(first.context_data['next_query'], 'after=%s' % first.context_data['page'].next_cursor)
+        self.assertFalse(cheeses.context_data['is_paginated'])
+
+class AnimalLookupTest(TestCase):
+    def test_uuid_prefixes(self):
+        from django.http import Http404
+        from farm.models import Genus, Breed, Animal
+        from farm.views import get_animal_or_404
+        breed = Breed.objects.create(title='Nubian', genus=Genus.objects.create(title='Goat'))
+        doe = Animal.objects.create(uuid='abcdef' + '0' * 26, name='Doe', sex='F', primary_breed=breed)
+        get = lambda key: get_animal_or_404(breed.genus.slug, breed.slug, key)
+        self.assertEqual(get('doe'), doe)
+        self.assertEqual(get('abcd'), doe)
+        self.assertRaises(Http404, get, 'abc')
+        self.assertRaises(Http404, get, 'a')
+
+class ConditionalGetTest(TestCase):
+    def test_etag_follows_related_changes(self):
+        from datetime import datetime
+        from django.core.cache import cache
+        from django.test.client import RequestFactory
+        from farm.models import Genus, Breed, Animal, Milking
+        from farm.views import AnimalDetailView
+        cache.clear()
+        breed = Breed.objects.create(title='Nubian', genus=Genus.objects.create(title='Goat'))
+        doe = Animal.objects.create(name='Doe', sex='F', primary_breed=breed)
+        view = AnimalDetailView.as_view()
+        kwargs = {'genus_slug': breed.genus.slug, 'breed_slug': breed.slug, 'slug': doe.slug}
+        get = lambda **headers: view(RequestFactory().get('/', **headers), **kwargs)
+
+        etag = get()['ETag']
+        self.assertEqual(get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Milking.objects.create(animal=doe, milking_time=datetime(2012, 3, 5, 8), quantity=2, units='l')
+        self.assertEqual(get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        Animal.objects.create(name='Kid', sex='F', primary_breed=breed, dam=doe)
+        self.assertNotEqual(get()['ETag'], etag)
+
+class ParlorSessionTest(TestCase):
+    def test_record_session(self):
+        from datetime import date, datetime
+        from farm.models import Genus, Breed, Animal, Milking
+        breed = Breed.objects.create(title='Nubian', genus=Genus.objects.create(title='Goat'))
+        daisy = Animal.objects.create(name='Daisy', sex='F', primary_breed=breed)
+        clover = Animal.objects.create(name='Clover', sex='F', primary_breed=breed)
+        milking_time = datetime(2012, 3, 5, 6)
+
+        milkings, errors = Milking.objects.record_session([{'animal': 'daisy', 'quantity': 2, 'units': 'l'},
+                {'animal': 'nobody', 'quantity': 1}, {'animal': 'daisy', 'quantity': 1}], milking_time)
+        self.assertEqual((milkings, errors), ([], [(2, 'Unknown animal nobody'), (3, 'Animal daisy is listed twice')]))
+        self.assertEqual(Milking.objects.count(), 0)
+
+        milkings, errors = Milking.objects.record_session([{'animal': 'daisy', 'quantity': 2, 'units': 'l'},
+                {'animal': clover.uuid[:8], 'quantity': 900}], milking_time)
+        self.assertEqual((len(milkings), errors), (2, []))
+        self.assertEqual(daisy.milk_production(date(2012, 3, 5), date(2012, 3, 5)), [(date(2012, 3, 5), 2000.0)])
+        self.assertEqual(clover.milk_production(date(2012, 3, 5), date(2012, 3, 5)), [(date(2012, 3, 5), 900.0)])
+
+class ExportTest(TestCase):
+    def test_export_reads_back(self):
+        from datetime import date
+        from StringIO import StringIO
+        from farm.exporter import export_lines
+        from farm.importer import read_rows
+        from farm.models import Genus, Breed, Animal, AnimalRegistration, RegistrationBody
+        breed = Breed.objects.create(title='Nubian', genus=Genus.objects.create(title='Goat'))
+        doe = Animal.objects.create(name='Doe', sex='F', primary_breed=breed)
+        kid = Animal.objects.create(name='Kid', sex='F', primary_breed=breed, dam=doe, birthday=date(2012, 3, 4))
+        AnimalRegistration.objects.create(animal=kid, body=RegistrationBody.objects.create(title='ADGA', breed=breed),
+                reg_id='N1')
+
+        for format in ('csv', 'jsonl'):
+            rows = list(read_rows(StringIO(''.join(export_lines('animals', format, batch_size=1))), format))
+            self.assertEqual([row['uuid'] for row in rows], [doe.uuid, kid.uuid])
+            self.assertEqual((rows[1]['dam'], rows[1]['birthday'], rows[1]['breed']), (doe.uuid, '2012-03-04', breed.slug))
+        self.assertEqual(rows[1]['registrations'], [['adga', 'N1', '']])
+
+class RefreshHerdTest(TestCase):
+    def test_backfills_stored_summaries(self):
+        from datetime import date, datetime
+        from StringIO import StringIO
+        from django.core.management import call_command
+        from farm.models import Genus, Breed, Animal, AnimalAncestry, Litter, Milking, MilkingRollup
+        from farm.testing import make_farm
+        farm = make_farm()
+        breed = Breed.objects.create(title='Nubian', genus=Genus.objects.create(title='Goat'))
+        doe = Animal.objects.create(name='Doe', sex='F', primary_breed=breed, owner_farm=farm)
+        Animal.objects.create(name='Kid', sex='F', primary_breed=breed, owner_farm=farm, dam=doe, birthday=date(2012, 3, 4))
+        Milking.objects.create(animal=doe, milking_time=datetime(2012, 3, 5, 8), quantity=2, units='l')
+        # As left by an upgrade from before these columns and tables existed.
+        Animal.objects.update(on_farm=False, breed_label='', litter=None)
+        Milking.objects.update(quantity_ml=0)
+        for model in (AnimalAncestry, Litter, MilkingRollup):
+            model.objects.all().delete()
+
+        call_command('refresh_herd', stdout=StringIO())
+        self.assertEqual(Animal.onthefarm_objects.count(), 2)
+        self.assertEqual(set(Animal.objects.values_list('breed_label', flat=True)), set([u'Nubian Goat']))
+        self.assertEqual(list(Animal.objects.get(name='Kid').ancestors()), [doe])
+        self.assertEqual(Animal.objects.get(name='Kid').litter.size, 1)
+        self.assertEqual(doe.milk_production(date(2012, 3, 5), date(2012, 3, 5)), [(date(2012, 3, 5), 2000.0)])
+
+class ImporterTest(TestCase):
+    def setUp(self):
+        from farm.models import Genus, Breed, RegistrationBody
+        from farm.testing import make_farm
+        genus = Genus.objects.create(title='Goat')
+        self.nubian = Breed.objects.create(title='Nubian', genus=genus)
+        Breed.objects.create(title='Alpine', genus=genus)
+        RegistrationBody.objects.create(title='ADGA', breed=self.nubian)
+        self.farm = make_farm()
+
+    def rows(self, does, first=0):
+        """A doe and a buck per doe, each doe with twins listed before her."""
+        uuid = lambda n: '%032x' % n
+        rows = []
+        for d in range(first, first + does):
+            doe, buck = uuid(4 * d), uuid(4 * d + 1)
+            for k in (2, 3):
+                rows.append({'uuid': uuid(4 * d + k), 'name': 'Kid %s-%s' % (d, k), 'sex': 'MF'[k % 2],
+                        'breed': 'nubian', 'owner_farm': 'home', 'birthday': '2012-03-0%s' % k, 'dam': doe,
+                        'sire': buck, 'secondary_breeds': 'alpine:25', 'registrations': 'adga:N%s-%s' % (d, k)})
+            rows.append({'uuid': doe, 'name': 'Doe %s' % d, 'sex': 'F', 'breed': 'nubian', 'owner_farm': 'home'})
+            rows.append({'uuid': buck, 'name': 'Buck %s' % d, 'sex': 'M', 'breed': 'nubian'})
+        return rows
+
+    def test_import_animals(self):
+        from farm.importer import HerdImporter
+        from farm.models import Animal
+        importer = HerdImporter()
+        importer.import_animals(self.rows(1))
+        self.assertEqual((importer.errors, importer.count), ([], 4))
+        doe = Animal.objects.get(name='Doe 0')
+        kid = Animal.objects.get(name='Kid 0-2')
+        self.assertEqual((kid.dam, kid.sire.name, kid.inbreeding), (doe, 'Buck 0', 0.0))
+        self.assertEqual((kid.breed_label, kid.breed_composition, kid.is_mixed),
+                (u'Mixed Nubian Goat', u'Nubian 75%, Alpine 25%', True))
+        self.assertEqual(list(kid.animalregistration_set.values_list('reg_id', flat=True)), ['N0-2'])
+        self.assertEqual(set(kid.ancestors()), set([doe, kid.sire]))
+        litter = doe.dam_litters.get()
+        self.assertEqual((litter.size, litter.born_alive, litter.sire.name), (2, 2, 'Buck 0'))
+        self.assertEqual(set(litter.animals.values_list('name', flat=True)), set(['Kid 0-2', 'Kid 0-3']))
+
+    def test_bad_and_duplicate_rows(self):
+        from farm.importer import HerdImporter
+        from farm.models import Animal
+        Animal.objects.create(uuid='%032x' % 1, name='Stored', sex='M', primary_breed=self.nubian)
+        rows = self.rows(1) + [{'uuid': '%032x' % 2, 'name': 'Again', 'breed': 'nubian'},
+                {'name': 'Nobody', 'breed': 'saanen'}]
+        for dry_run in (True, False):
+            importer = HerdImporter(dry_run=dry_run)
+            importer.import_animals(rows)
+            self.assertEqual(importer.errors, [(6, 'Unknown breed saanen'), (4, 'Animal %032x already exists' % 1),
+                    (5, 'Duplicate uuid %032x' % 2)])
+            self.assertEqual(Animal.objects.filter(name__startswith='Kid').count(), 0 if dry_run else 2)
+        self.assertEqual(Animal.objects.get(name='Kid 0-2').sire.name, 'Stored')
+
+    def test_queries_do_not_grow_with_the_herd(self):
+        from farm.importer import HerdImporter
+        from farm.testing import measure
+        # Only the bulk INSERTs, split to the database's parameter limit,
+        # may grow with the number of rows.
+        count = lambda measurement: len([q for q in measurement.queries if not q['sql'].startswith('INSERT')])
+        small = measure(HerdImporter().import_animals, self.rows(5))
+        large = measure(HerdImporter().import_animals, self.rows(40, first=5))
+        self.assertEqual(count(large), count(small))
+
+def touch(value):
+    """Reads what a template would read from a context value."""
+    if isinstance(value, dict):
+        for item in value.values():
+            touch(item)
+        return
+    items = value if hasattr(value, '__iter__') and not isinstance(value, basestring) else [value]
+    from farm.models import Animal
+    for item in items:
+        unicode(item)
+        if hasattr(item, 'get_absolute_url'):
+            item.get_absolute_url()
+        if isinstance(item, Animal):
+            item.display_name, item.breed, item.location, item.origin, item.age
+            list(item.notes.all())
+
+class HerdBenchmark(TestCase):
+    """
+    Measures every page and template tag of the farm on a small herd, then
+    again once the herd has grown, and fails when a query count grows with
+    the herd. Set FARM_BENCHMARK_REPORT to print the measurements.
+    """
+    urls = 'farm.test_urls'
+
+    def setUp(self):
+        from django.core.cache import cache
+        from farm.testing import make_herd
+        cache.clear()
+        self.herd = make_herd(generations=2, milkings=3)
+        self.doe = self.herd['does'][0]
+        self.results = []
+
+    def tearDown(self):
+        from django.conf import settings
+        if getattr(settings, 'FARM_BENCHMARK_REPORT', False):
+            for name, small, large in self.results:
+                print '%-40s %r -> %r' % (name, small, large)
+
+    def pages(self):
+        from django.core.urlresolvers import reverse
+        breed = self.doe.primary_breed
+        kwargs = {'genus_slug': breed.genus.slug, 'breed_slug': breed.slug, 'slug': self.doe.slug}
+        product, building, field = self.herd['product'], self.herd['building'], self.herd['field']
+        return [
+            reverse('fm-genus-list'),
+            reverse('fm-genus-detail', kwargs={'slug': breed.genus.slug}),
+            reverse('fm-breed-detail', kwargs={'genus_slug': breed.genus.slug, 'slug': breed.slug}),
+            reverse('fm-animal-detail', kwargs=kwargs),
+            reverse('fm-milking-detail', kwargs=kwargs),
+            reverse('fm-product-list'),
+            reverse('fm-product-type-detail', kwargs={'slug': product.type.slug}),
+            reverse('fm-product-detail', kwargs={'type_slug': product.type.slug, 'slug': product.slug}),
+            reverse('fm-building-list'),
+            reverse('fm-building-detail', kwargs={'slug': building.slug}),
+            reverse('fm-building-space-detail', kwargs={'building_slug': building.slug, 'slug': self.herd['space'].slug}),
+            reverse('fm-field-list'),
+            reverse('fm-field-detail', kwargs={'slug': field.slug}),
+            reverse('fm-animal-pedigree', kwargs=kwargs),
+            reverse('fm-animal-matings', kwargs=kwargs),
+            reverse('fm-search') + '?q=kid',
+            reverse('fm-stats'),
+            reverse('fm-export', kwargs={'kind': 'animals', 'format': 'csv'}),
+            reverse('fm-export', kwargs={'kind': 'milkings', 'format': 'jsonl'}),
+            reverse('fm-milking-session'),
+        ]
+
+    def get(self, path):
+        from django.contrib.auth.models import User
+        from django.core.urlresolvers import resolve
+        from django.test.client import RequestFactory
+        match = resolve(path.split('?')[0])
+        request = RequestFactory().get(path)
+        request.user = User(username='admin', is_staff=True, is_superuser=True)
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'context_data'):
+            touch(response.context_data or {})
+        else:
+            # Streamed responses only query as they are read.
+            list(response)
+
+    def tags(self):
+        from django.core.cache import cache
+        from django.template import Context, Template
+        from farm.templatetags.farm_tags import child_table_for
+        cache.clear()
+        Template('{% load farm_tags %}{% get_genuses as genuses %}{% get_breeds as breeds %}'
+                 '{% get_named_animals as animals %}{% for a in animals %}{{ a }}{{ a.breed }}{% endfor %}'
+                 ).render(Context())
+        touch(child_table_for(self.doe))
+
+    def litters(self):
+        from farm.models import Animal
+        touch(Animal.objects.get(pk=self.doe.pk).litters())
+
+    def changelist(self):
+        from django.contrib.admin import site
+        from django.contrib.auth.models import User
+        from django.test.client import RequestFactory
+        from farm.models import Animal
+        request = RequestFactory().get('/admin/farm/animal/')
+        request.user = User(username='admin', is_staff=True, is_superuser=True)
+        site._registry[Animal].changelist_view(request).render()
+
+    def compare(self, name, func, *args):
+        from farm.testing import grow_herd
+        small = measure_cold(func, *args)
+        grow_herd(self.herd, litters=2)
+        large = measure_cold(func, *args)
+        self.results.append((name, small, large))
+        self.assertTrue(len(large.queries) <= len(small.queries),
+                '%s ran %s queries on a small herd, %s on a larger one' % (name, len(small.queries), len(large.queries)))
+
+    def test_pages(self):
+        for path in self.pages():
+            self.compare(path, self.get, path)
+
+    def test_template_tags(self):
+        self.compare('template tags', self.tags)
+
+    def test_litters(self):
+        self.compare('Animal.litters()', self.litters)
+
+    def test_admin_changelist(self):
+        self.compare('admin animal changelist', self.changelist)
+
+def measure_cold(func, *args):
+    from django.core.cache import cache
+    from farm.testing import measure
+    cache.clear()
+    return measure(func, *args)
@@ -1,27 +1,35 @@
 from django.conf import settings
 from django.conf.urls.defaults import *
-from django.views.generic import DetailView, ListView
-from farm.views import BreedDetailView, AnimalDetailView, ProductDetailView, MilkingListView
+from django.views.generic import DetailView
+from farm.views import BreedDetailView, AnimalDetailView, animal_mating_plan, animal_pedigree, ProductDetailView, ConditionalDetailView, KeysetListView, MilkingListView, SearchView, export, herd_stats, instrumentation_stats, record_milkings
 from farm.models import Animal, Genus, Breed, Product, ProductType, RegistrationBody, AnimalRegistration, Building, BuildingSpace, Field
 
 
 # custom views vendors
 urlpatterns = patterns('',
-    url(r'^animals/$', view=ListView.as_view(model=Genus), name="fm-genus-list"),
+    url(r'^animals/$', view=KeysetListView.as_view(model=Genus), name="fm-genus-list"),
 	url(r'^animals/(?P<slug>[-\w]+)/$', view=DetailView.as_view(model=Genus), name="fm-genus-detail"),
 	url(r'^animals/(?P<slug>[-\w]+)/$', view=DetailView.as_view(model=Genus), name="fm-genus-detail"),
 	url(r'^animals/(?P<genus_slug>[-\w]+)/(?P<slug>[-\w]+)/$', view=BreedDetailView.as_view(), name="fm-breed-detail"),
 	url(r'^animals/(?P<genus_slug>[-\w]+)/(?P<breed_slug>[-\w]+)/(?P<slug>[-\w]+)/$', view=AnimalDetailView.as_view(), name="fm-animal-detail"),
 	url(r'^animals/(?P<genus_slug>[-\w]+)/(?P<breed_slug>[-\w]+)/(?P<slug>[-\w]+)/milkings/$', view=MilkingListView.as_view(), name="fm-milking-detail"),
+	url(r'^animals/(?P<genus_slug>[-\w]+)/(?P<breed_slug>[-\w]+)/(?P<slug>[-\w]+)/pedigree/$', view=animal_pedigree, name="fm-animal-pedigree"),
+	url(r'^animals/(?P<genus_slug>[-\w]+)/(?P<breed_slug>[-\w]+)/(?P<slug>[-\w]+)/matings/$', view=animal_mating_plan, name="fm-animal-matings"),
 
-    url(r'^products/$', view=ListView.as_view(model=Product), name="fm-product-list"),
+    url(r'^products/$', view=KeysetListView.as_view(model=Product, related=('type',), filters={'type': 'type__slug'}), name="fm-product-list"),
     url(r'^products/(?P<slug>[-\w]+)/$', view=DetailView.as_view(model=ProductType), name="fm-product-type-detail"),
     url(r'^products/(?P<type_slug>[-\w]+)/(?P<slug>[-\w]+)/$', view=ProductDetailView.as_view(), name="fm-product-detail"),
 
-    url(r'^buildings/$', view=ListView.as_view(model=Building), name="fm-building-list"),
-    url(r'^buildings/(?P<slug>[-\w]+)/$', view=DetailView.as_view(model=Building), name="fm-building-detail"),
+    url(r'^buildings/$', view=KeysetListView.as_view(model=Building, filters={'farm': 'farm__slug'}), name="fm-building-list"),
+    url(r'^buildings/(?P<slug>[-\w]+)/$', view=ConditionalDetailView.as_view(model=Building), name="fm-building-detail"),
     url(r'^buildings/(?P<building_slug>[-\w]+)/(?P<slug>[-\w]+)/$', view=DetailView.as_view(model=BuildingSpace), name="fm-building-space-detail"),
 
-    url(r'^fields/$', view=ListView.as_view(model=Field), name="fm-field-list"),
-    url(r'^fields/(?P<slug>[-\w]+)/$', view=DetailView.as_view(model=Field), name="fm-field-detail"),
+    url(r'^fields/$', view=KeysetListView.as_view(model=Field, filters={'farm': 'farm__slug', 'type': 'type__slug'}), name="fm-field-list"),
+    url(r'^fields/(?P<slug>[-\w]+)/$', view=ConditionalDetailView.as_view(model=Field), name="fm-field-detail"),
+
+    url(r'^milkings/session/$', view=record_milkings, name="fm-milking-session"),
+    url(r'^export/(?P<kind>animals|milkings|products)\.(?P<format>csv|jsonl)$', view=export, name="fm-export"),
+    url(r'^search/$', view=SearchView.as_view(), name="fm-search"),
+    url(r'^stats/$', view=herd_stats, name="fm-stats"),
+    url(r'^instrumentation/$', view=instrumentation_stats, name="fm-instrumentation"),
 )
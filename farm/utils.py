@@ -1,5 +1,6 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
+from django.utils.datastructures import SortedDict
 
 def get_fancy_time(rdelta, display_full_version = False):
     """Returns a user friendly date format
@@ -28,6 +29,86 @@ def get_fancy_time(rdelta, display_full_version = False):
             return primary_unit
     return None
 
+_AGES = {}
+
+def format_age(days):
+    """Returns the get_fancy_time text for an age given in days.
+
+    Results are memoized per day, so a herd list formats each distinct age
+    once.
+    """
+    today = date.today()
+    key = (today, days)
+    if key not in _AGES:
+        if len(_AGES) > 10000:
+            _AGES.clear()
+        _AGES[key] = get_fancy_time(relativedelta(today, today - timedelta(days=days)), True)
+    return _AGES[key]
+
+def chunks(items, size):
+    """Yields successive lists of at most ``size`` items from ``items``."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def group_litters(animals, window):
+    """Clusters animals into litters in a single pass.
+
+    animals: animals ordered by birthday
+    window: timedelta allowed between two consecutive births of one litter
+
+    Returns a SortedDict mapping the first birthday of each litter to the
+    animals born in it.
+    """
+    litters = SortedDict()
+    start = last = None
+    for animal in animals:
+        if last is None or animal.birthday - last > window:
+            start = animal.birthday
+            litters[start] = []
+        litters[start].append(animal)
+        last = animal.birthday
+    return litters
+
+def topological_order(parents):
+    """Orders a pedigree so that every animal comes after its dam and sire.
+
+    parents: dict mapping an animal id to a (dam_id, sire_id) pair; parents
+    missing from the dict are treated as unknown.
+
+    Animals are returned one generation at a time, with full siblings next to
+    each other. Raises ValueError if the pedigree contains a cycle.
+    """
+    children = {}
+    waiting = {}
+    for pk, pair in parents.iteritems():
+        known = set(p for p in pair if p in parents)
+        waiting[pk] = len(known)
+        for p in known:
+            children.setdefault(p, []).append(pk)
+
+    order = []
+    generation = [pk for pk, count in waiting.iteritems() if count == 0]
+    while generation:
+        generation.sort(key=lambda pk: (parents[pk], pk))
+        order.extend(generation)
+        next_generation = []
+        for pk in generation:
+            for child in children.get(pk, ()):
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    next_generation.append(child)
+        generation = next_generation
+
+    if len(order) != len(parents):
+        raise ValueError('Pedigree contains a cycle')
+    return order
+
 if __name__ == "__main__":
     data_sets = [datetime.utcnow() + relativedelta(seconds=-3),
                         datetime.utcnow() + relativedelta(minutes=-2, seconds=-6),
@@ -1,47 +1,233 @@
+import calendar
 import datetime
+import json
+import time
+from hashlib import md5
+
 from django.views.generic import DetailView, ListView
 
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponseRedirect, Http404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseRedirect, Http404
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5 streams an iterator given to HttpResponse.
+    StreamingHttpResponse = HttpResponse
 from django.shortcuts import get_list_or_404, render_to_response, get_object_or_404
 from django.template import RequestContext
+from django.template.loader import render_to_string
 from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext as _
+from django.views.decorators.http import condition
 
+from farm import exporter, instrumentation, planner, search, stats
+from farm.caching import cached, object_namespace, version
+from farm.forms import ParlorSessionForm
+from farm.managers import UUID_PREFIX
 from farm.models import Animal, Breed, Product, Milking
+from farm.pagination import keyset_paginate
+from farm.pedigree import chart, chart_rows
 from notes.forms import BriefNoteForm
 
-class BreedDetailView(DetailView):
+def timestamp(value):
+    if value.tzinfo is not None:
+        return calendar.timegm(value.utctimetuple())
+    return time.mktime(value.timetuple())
+
+class ConditionalMixin(object):
+    """
+    Answers conditional GETs of a detail page with 304 Not Modified. The
+    page's Last-Modified and ETag come from the object's modified time and
+    the versions of the cache namespaces from get_versions(), which
+    farm.signals bumps when related rows such as children, milkings and
+    notes change.
+    """
+    def get_versions(self):
+        return [object_namespace(self.model, self.object.pk)]
+
+    def get(self, request, *args, **kwargs):
+        # The object was fetched by dispatch() already.
+        return self.render_to_response(self.get_context_data(object=self.object))
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super(ConditionalMixin, self).dispatch(request, *args, **kwargs)
+        self.request, self.args, self.kwargs = request, args, kwargs
+        self.object = self.get_object()
+        changed = version(*self.get_versions())
+        if getattr(self.object, 'modified', None):
+            changed = max(changed, timestamp(self.object.modified))
+        etag = md5('%s:%r' % (object_namespace(self.model, self.object.pk), changed)).hexdigest()
+        last_modified = datetime.datetime.utcfromtimestamp(int(changed))
+        view = condition(etag_func=lambda *a, **kw: etag, last_modified_func=lambda *a, **kw: last_modified)(
+                super(ConditionalMixin, self).dispatch)
+        return view(request, *args, **kwargs)
+
+class ConditionalDetailView(ConditionalMixin, DetailView):
+    pass
+
+class BreedDetailView(ConditionalMixin, DetailView):
     model = Breed
 
     def get_queryset(self, *args, **kwargs):
-        return Breed.objects.filter(genus__slug=self.kwargs['genus_slug'])
+        return Breed.objects.select_related('genus').filter(genus__slug=self.kwargs['genus_slug'])
 
-class ProductDetailView(DetailView):
+    def get_context_data(self, **kwargs):
+        context = super(BreedDetailView, self).get_context_data(**kwargs)
+        context['animal_list'] = Animal.onthefarm_objects.for_display().filter(primary_breed=self.object)
+        return context
+
+class ProductDetailView(ConditionalMixin, DetailView):
     model = Product
 
     def get_queryset(self, *args, **kwargs):
         return Product.objects.filter(type__slug=self.kwargs['type_slug'])
 
-class MilkingListView(ListView):
-    model = Animal
+ANIMAL_CACHE_TIMEOUT = getattr(settings, 'FARM_ANIMAL_CACHE_TIMEOUT', 60 * 60)
+
+def get_animal_or_404(genus_slug, breed_slug, slug_or_uuid, queryset=None):
+    """
+    Resolves an animal of a breed by its slug, then by an anchored prefix of
+    its indexed uuid at least UUID_PREFIX characters long, raising Http404
+    when nothing or more than one animal matches.
+
+    Resolved pks are cached per URL; a cached pk is only trusted if the
+    animal it points to still matches, so renames and deletes need no
+    invalidation.
+    """
+    if queryset is None:
+        queryset = Animal.objects.filter(primary_breed__genus__slug=genus_slug, primary_breed__slug=breed_slug)
+    cache_key = 'farm:animal:%s:%s:%s' % (genus_slug, breed_slug, slug_or_uuid)
+    pk = cache.get(cache_key)
+    if pk is not None:
+        try:
+            animal = queryset.get(pk=pk)
+            if animal.slug == slug_or_uuid or (len(slug_or_uuid) >= UUID_PREFIX and animal.uuid.startswith(slug_or_uuid)):
+                return animal
+        except ObjectDoesNotExist:
+            pass
+
+    try:
+        animal = queryset.get(slug=slug_or_uuid)
+    except ObjectDoesNotExist:
+        matches = []
+        if len(slug_or_uuid) >= UUID_PREFIX:
+            matches = list(queryset.filter(uuid__startswith=slug_or_uuid)[:2])
+        if len(matches) != 1:
+            raise Http404(_(u"No %(verbose_name)s found matching the query") %
+                           {'verbose_name': Animal._meta.verbose_name})
+        animal = matches[0]
+    cache.set(cache_key, animal.pk, ANIMAL_CACHE_TIMEOUT)
+    return animal
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+class KeysetListView(ListView):
+    """
+    List ordered by (ordering, pk) and paged with ?after=<pk>, so every page
+    costs the same however far into the list it is. filters maps query
+    string parameters to the lookups they narrow the list with, related
+    names the relations to fetch along. Templates get the page as page and
+    page_obj, and can include farm/keyset_pagination.html to link to the
+    next one.
+    """
+    ordering = 'title'
+    per_page = 50
+    filters = {}
+    related = ()
 
     def get_queryset(self, *args, **kwargs):
+        qs = super(KeysetListView, self).get_queryset(*args, **kwargs)
+        if self.related:
+            qs = qs.select_related(*self.related)
+        self.selected = {}
+        for param, lookup in self.filters.iteritems():
+            value = self.request.GET.get(param)
+            if value:
+                self.selected[param] = value
+                qs = qs.filter(**{lookup: value})
+        return qs
+
+    def get_context_object_name(self, object_list):
+        # The page is a list, which ListView would give no name.
+        if self.context_object_name:
+            return self.context_object_name
+        return '%s_list' % self.model._meta.object_name.lower()
+
+    def get_context_data(self, **kwargs):
         try:
-            animal = Animal.objects.get(self.kwargs.get('slug', None))
-            qs = Milking.objects.filter(animal__primary_breed__genus__slug=self.kwargs['genus_slug'], animal__primary_breed__slug=self.kwargs['breed_slug'], animal__slug=self.kwargs['slug'])
-        except:
-            try:
-                qs = Milking.objects.filter(animal__primary_breed__genus__slug=self.kwargs['genus_slug'], animal__primary_breed__slug=self.kwargs['breed_slug'], animal__uuid__contains=self.kwargs['slug'])
-            except:
-                qs = None
+            page = keyset_paginate(kwargs.pop('object_list'), self.ordering, self.request.GET.get('after'), self.per_page)
+        except ValueError:
+            raise Http404
+        context = super(KeysetListView, self).get_context_data(object_list=page.object_list, **kwargs)
+        query = self.request.GET.copy()
+        query.pop('after', None)
+        first_query = query.urlencode()
+        query['after'] = page.next_cursor or ''
+        context.update({'page': page, 'page_obj': page, 'is_paginated': page.has_other_pages(),
+                'first_query': first_query, 'next_query': query.urlencode(), 'selected': getattr(self, 'selected', {})})
+        return context
+
+class MilkingListView(KeysetListView):
+    """
+    Milkings of one animal, newest first, optionally limited to the start
+    and end dates given in the query string.
+    """
+    model = Milking
+    context_object_name = 'milking_list'
+    ordering = '-milking_time'
+
+    def get_queryset(self, *args, **kwargs):
+        self.animal = get_animal_or_404(self.kwargs['genus_slug'], self.kwargs['breed_slug'], self.kwargs['slug'])
+        self.start = parse_date(self.request.GET.get('start'))
+        self.end = parse_date(self.request.GET.get('end'))
+        qs = Milking.objects.filter(animal=self.animal.pk).select_related('animal__primary_breed__genus')
+        if self.start:
+            qs = qs.filter(milking_time__gte=self.start)
+        if self.end:
+            qs = qs.filter(milking_time__lt=self.end + datetime.timedelta(days=1))
         return qs
 
-class AnimalDetailView(DetailView):
+    def get_context_data(self, **kwargs):
+        context = super(MilkingListView, self).get_context_data(**kwargs)
+        context.update({'animal': self.animal, 'start': self.start, 'end': self.end})
+        return context
+
+class SearchView(ListView):
+    """
+    Search results for ?q=, narrowed by the genus, breed, sex and farm
+    facets given in the query string.
+    """
+    template_name = 'farm/search.html'
+    context_object_name = 'entry_list'
+    paginate_by = 25
+    facets = ('genus', 'breed', 'sex', 'farm')
+
+    def get_queryset(self, *args, **kwargs):
+        self.query = self.request.GET.get('q', '')
+        self.selected = dict((name, self.request.GET.get(name)) for name in self.facets)
+        entries, self.facet_counts = search.search(self.query, **self.selected)
+        return entries
+
+    def get_context_data(self, **kwargs):
+        context = super(SearchView, self).get_context_data(**kwargs)
+        context.update({'query': self.query, 'selected': self.selected, 'facets': self.facet_counts})
+        return context
+
+class AnimalDetailView(ConditionalMixin, DetailView):
     model = Animal
 
     def get_queryset(self, *args, **kwargs):
-        return Animal.objects.filter(primary_breed__genus__slug=self.kwargs['genus_slug'], primary_breed__slug=self.kwargs['breed_slug'])
+        return Animal.objects.for_display().filter(primary_breed__genus__slug=self.kwargs['genus_slug'], primary_breed__slug=self.kwargs['breed_slug'])
 
     def get_object(self, queryset=None):
         if queryset is None:
@@ -50,18 +236,11 @@ class AnimalDetailView(DetailView):
         pk = self.kwargs.get('pk', None)
         slug_or_uuid = self.kwargs.get('slug', None)
         if pk is not None:
-            queryset = queryset.filter(pk=pk)
+            return get_object_or_404(queryset, pk=pk)
 
-        # Next, try looking up by slug.
+        # Next, try looking up by slug, then by uuid prefix.
         elif slug_or_uuid is not None:
-            try:
-                obj = queryset.filter(uuid__contains=slug_or_uuid)[0]
-            except:
-                try:
-                    obj = queryset.get(slug=slug_or_uuid)
-                except ObjectDoesNotExist:
-                    raise Http404(_(u"No %(verbose_name)s found matching the query") %
-                                   {'verbose_name': queryset.model._meta.verbose_name})
+            return get_animal_or_404(self.kwargs['genus_slug'], self.kwargs['breed_slug'], slug_or_uuid, queryset)
 
         # If none of those are defined, it's an error.
         else:
@@ -69,9 +248,119 @@ class AnimalDetailView(DetailView):
                                  u"either an object pk or a slug."
                                  % self.__class__.__name__)
 
-        return obj
-
     def get_context_data(self, **kwargs):
         context = super(AnimalDetailView, self).get_context_data(**kwargs)
         context['note_form'] = BriefNoteForm()
         return context
+
+@staff_member_required
+def instrumentation_stats(request):
+    """
+    Instrumentation totals per view and tag as JSON, for this process or,
+    with ?all=1, merged over every process that flushed to the cache.
+    """
+    if request.GET.get('all'):
+        instrumentation.flush()
+        totals = instrumentation.collected()
+    else:
+        totals = instrumentation.stats()
+    return HttpResponse(json.dumps(totals, indent=2, sort_keys=True), content_type='application/json')
+
+def herd_stats(request):
+    """Herd-wide statistics from farm.stats as JSON."""
+    return HttpResponse(json.dumps(stats.summary(), cls=DjangoJSONEncoder), content_type='application/json')
+
+@staff_member_required
+def record_milkings(request):
+    """
+    Records a parlor session in one go, posted either as the
+    ParlorSessionForm or as JSON: {"milking_time": "2012-03-05T06:00:00",
+    "rows": [{"animal": "daisy", "quantity": 2, "units": "l"}, ...]}.
+    JSON posts are answered with the number of milkings recorded and the
+    errors per row, nothing being recorded unless every row is valid.
+    """
+    if request.method == 'POST' and request.META.get('CONTENT_TYPE', '').startswith('application/json'):
+        try:
+            data = json.loads(request.body)
+            milking_time = parse_datetime(data['milking_time'])
+            if milking_time is None:
+                raise ValueError('Invalid milking_time')
+            milkings, errors = Milking.objects.record_session(data['rows'], milking_time)
+        except (ValueError, TypeError, KeyError), e:
+            milkings, errors = [], [(None, unicode(e))]
+        content = json.dumps({'recorded': len(milkings), 'errors': [{'row': row, 'error': error} for row, error in errors]})
+        return HttpResponse(content, content_type='application/json', status=400 if errors else 200)
+
+    milkings, errors = [], []
+    if request.method == 'POST':
+        form = ParlorSessionForm(request.POST)
+        if form.is_valid():
+            milkings, errors = Milking.objects.record_session(form.rows(), form.cleaned_data['milking_time'])
+            if milkings:
+                form = ParlorSessionForm(initial={'units': form.cleaned_data['units']})
+    else:
+        form = ParlorSessionForm()
+    return render_to_response('farm/milking_session.html', {'form': form, 'recorded': len(milkings), 'errors': errors},
+            context_instance=RequestContext(request))
+
+EXPORT_CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+
+@staff_member_required
+def export(request, kind, format):
+    """Streams the animals, milkings or products as a CSV or JSON-lines file."""
+    if kind not in exporter.EXPORTS or format not in EXPORT_CONTENT_TYPES:
+        raise Http404
+    response = StreamingHttpResponse(exporter.export_lines(kind, format), content_type=EXPORT_CONTENT_TYPES[format])
+    response['Content-Disposition'] = 'attachment; filename=%s.%s' % (kind, format)
+    return response
+
+PEDIGREE_GENERATIONS = 4
+PEDIGREE_MAX_GENERATIONS = 6
+
+def render_pedigree(rows, generations):
+    layout = chart(rows, generations)
+    for box in layout['boxes']:
+        row = box['animal']
+        box['url'] = reverse('fm-animal-detail', kwargs={'genus_slug': row['primary_breed__genus__slug'],
+                'breed_slug': row['primary_breed__slug'], 'slug': row['slug']})
+    return render_to_string('farm/pedigree.svg', layout)
+
+def animal_pedigree(request, genus_slug, breed_slug, slug):
+    """
+    Pedigree chart of an animal, ?generations=N back, as a page or with
+    ?format=svg as the bare SVG. The SVG is cached under the modification
+    times and breed labels of the animal and every ancestor shown, so it is
+    only rendered again once one of them changes; breed labels are
+    refreshed with update(), which leaves modified alone.
+    """
+    animal = get_animal_or_404(genus_slug, breed_slug, slug)
+    try:
+        generations = int(request.GET.get('generations', PEDIGREE_GENERATIONS))
+    except ValueError:
+        generations = PEDIGREE_GENERATIONS
+    generations = min(max(generations, 1), PEDIGREE_MAX_GENERATIONS)
+
+    rows = chart_rows(animal, generations)
+    digest = md5(repr(sorted((row['pk'], row['modified'], row['breed_label']) for row in rows))).hexdigest()
+    svg = cached('detail', ['pedigree', animal.pk, generations, digest],
+            lambda: render_pedigree(rows, generations))
+
+    if request.GET.get('format') == 'svg':
+        return HttpResponse(svg, content_type='image/svg+xml')
+    return render_to_response('farm/animal_pedigree.html', {'animal': animal, 'generations': generations, 'svg': svg},
+            context_instance=RequestContext(request))
+
+def animal_mating_plan(request, genus_slug, breed_slug, slug):
+    """
+    The on-the-farm sires of a dam's genus ranked as mates for her, see
+    farm.planner; ?breed=<slug> ranks for that breed's share in the kids.
+    """
+    dam = get_animal_or_404(genus_slug, breed_slug, slug, Animal.objects.select_related('primary_breed__genus').filter(
+            primary_breed__genus__slug=genus_slug, primary_breed__slug=breed_slug))
+    if dam.sex != 'F':
+        raise Http404
+    breed = None
+    if request.GET.get('breed'):
+        breed = get_object_or_404(Breed, genus=dam.primary_breed.genus_id, slug=request.GET['breed'])
+    return render_to_response('farm/mating_plan.html', {'animal': dam, 'breed': breed or dam.primary_breed,
+            'pairings': planner.rank_sires(dam, breed)}, context_instance=RequestContext(request))
@@ -18,7 +18,7 @@ setup(
 
     include_package_data=True,
 
-    packages=['farm'],
+    packages=find_packages(),
 
     zip_safe=True,
     classifiers=[